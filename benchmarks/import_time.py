@@ -0,0 +1,40 @@
+"""Measures how long `import bext` takes in a fresh Python process.
+
+Run this from the repository root:
+
+    python benchmarks/import_time.py [runs]
+
+Bext is imported by command line programs that start up many times, so this
+should stay well under the time it takes to start Python itself."""
+
+import os, subprocess, sys, time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def time_command(code, runs):
+    """Returns the fastest time out of `runs` runs of `code` in a new
+    Python process, in seconds."""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    time_command('import bext', 1) # Write the .pyc files first.
+    python = time_command('pass', runs)
+    withBext = time_command('import bext', runs)
+    print('python -c pass:        %6.1f ms' % (python * 1000))
+    print('python -c import bext: %6.1f ms' % (withBext * 1000))
+    print('import bext:           %6.1f ms' % ((withBext - python) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -174,17 +174,14 @@ try:
         screenPoints = tuple(frozenset(screenPoints)) # Get rid of duplicate points.
 
         # Draw cube
-        for x, y in screenPoints:
-            # Writing to the terminal will by far be the slowest part of this program.
-            bext.goto(x, y)
-            print(BLOCK, end='')
+        # Writing to the terminal will by far be the slowest part of this program,
+        # so draw all of the points with a single write.
+        bext.plot(screenPoints, BLOCK)
 
         time.sleep(0.1)
 
         # Erase cube
-        for x, y in screenPoints:
-            bext.goto(x, y)
-            print(' ', end='')
+        bext.erase(screenPoints)
 
 except KeyboardInterrupt:
     pass
@@ -23,6 +23,7 @@ setup(
     package_dir={'': 'src'},
     test_suite='tests',
     install_requires=['colorama<=0.4.5'], # 0.4.6 causes problems on Windows.
+    extras_require={'numpy': ['numpy']}, # Used by Screen.blit() and Screen.to_array().
     keywords='',
     classifiers=[
         'Programming Language :: Python',
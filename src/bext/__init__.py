@@ -8,7 +8,9 @@
 
 __version__ = '0.1.1'
 
-import colorama, sys, os, random, shutil
+import array, atexit, codecs, collections, functools, io, operator, sys, os, time
+# colorama, random, shutil, and signal are imported by the functions that use
+# them, since importing them takes most of the time that importing bext takes.
 from contextlib import contextmanager
 
 ALL_COLORS = ('black', 'red', 'green', 'yellow', 'blue', 'purple', 'cyan', 'white')
@@ -343,53 +345,304 @@ unixCodeToNameMapping = {
     '\x1b[F': 'end',
     '\x1b[5': 'page-up',
     '\x1b[6': 'page-down',
+    '\x1b[5~': 'page-up',
+    '\x1b[6~': 'page-down',
     '\x7f': 'backspace',
     '\x1b[2~': 'insert',
     '\x1b[3~': 'delete',
 }
 unixCodeToNameMapping.update(commonCodeToNameMapping)
 
-windowsPrefixes = set()
-for code, key in windowsCodeToNameMapping.items():
-    if len(code) > 1:
-        for i in range(len(code)):
-            windowsPrefixes.add(code[:i])
+@functools.lru_cache(maxsize=None)
+def _windows_prefixes():
+    """Returns the set of the starts of the multi-character Windows key codes,
+    which is built the first time a key is read on Windows."""
+    prefixes = set()
+    for code in windowsCodeToNameMapping:
+        if len(code) > 1:
+            for i in range(len(code)):
+                prefixes.add(code[:i])
+    return frozenset(prefixes)
+
+# The modifier keys encoded in the last parameter of CSI key codes such as
+# '\x1b[1;5A' (ctrl-up). The parameter is 1 plus the sum of these bits.
+_CSI_MODIFIERS = ((4, 'ctrl-'), (2, 'alt-'), (1, 'shift-'), (8, 'meta-'))
+
+
+# A mouse event returned by get_key() after enable_mouse() is called. The
+# action is 'press', 'release', 'drag', 'move', or 'wheel'. The button is
+# 'left', 'middle', or 'right', or for the wheel 'up', 'down', 'left', or
+# 'right', or None for 'move'. (0, 0) is the top-left corner cell.
+MouseEvent = collections.namedtuple('MouseEvent', 'action button x y')
+
+_MOUSE_BUTTONS = ('left', 'middle', 'right', None)
+_MOUSE_WHEEL_BUTTONS = ('up', 'down', 'left', 'right')
+
+
+def _parse_mouse_code(code):
+    """Returns a MouseEvent for the SGR mouse code `code`, such as
+    '\x1b[<0;10;5M', or None if `code` isn't a mouse code."""
+    if not (code.startswith('\x1b[<') and code[-1:] in ('M', 'm')):
+        return None
+    try:
+        buttonBits, x, y = (int(param) for param in code[3:-1].split(';'))
+    except ValueError:
+        return None
+
+    # The low 2 bits are the button, 32 is set for motion and 64 for the
+    # wheel. (4, 8 and 16 are for the shift, alt, and ctrl keys.)
+    if buttonBits & 64:
+        return MouseEvent('wheel', _MOUSE_WHEEL_BUTTONS[buttonBits & 3], x - 1, y - 1)
+    button = _MOUSE_BUTTONS[buttonBits & 3]
+    if buttonBits & 32:
+        return MouseEvent('move' if button is None else 'drag', button, x - 1, y - 1)
+    return MouseEvent('press' if code[-1] == 'M' else 'release', button, x - 1, y - 1)
+
+
+def _is_same_mouse_motion(event1, event2):
+    """Returns True if the codes or MouseEvents `event1` and `event2` are
+    both mouse motion events with the same action and button, in which case
+    only the later one needs to be kept."""
+    if not isinstance(event1, MouseEvent):
+        event1 = _parse_mouse_code(event1)
+    if not isinstance(event2, MouseEvent):
+        event2 = _parse_mouse_code(event2)
+    return (event1 is not None and event2 is not None and event1.action in ('move', 'drag') and
+            event1[:2] == event2[:2])
+
+
+class KeyDecoder(object):
+    """Splits terminal input into the codes of individual keys. Input is given
+    to feed() as it arrives, in any size of chunk, and the codes of the
+    complete keys are returned.
+
+    The codes in `mapping` are matched with a trie, so each character is
+    only looked at once. Any other CSI escape sequence (ESC [ followed by
+    parameters and a final character) is kept together as one code. Since the
+    esc key sends the same character that starts escape sequences, an esc
+    that isn't followed by the rest of a sequence within `esc_timeout`
+    seconds is the esc key; call flush() once timeout_remaining() reaches 0."""
+
+    def __init__(self, mapping, encoding='utf-8', esc_timeout=0.05):
+        self.mapping = mapping
+        self.esc_timeout = esc_timeout
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._pending = '' # The start of an escape sequence that hasn't finished arriving.
+        self._pendingSince = None
+
+        # Each trie node is a dict of the next characters to their child
+        # nodes. The None key holds the complete code that ends at that node.
+        self._trie = {}
+        for code in mapping:
+            node = self._trie
+            for char in code:
+                node = node.setdefault(char, {})
+            node[None] = code
 
-unixPrefixes = set()
-for code, key in unixCodeToNameMapping.items():
-    if len(code) > 1:
-        for i in range(len(code)):
-            unixPrefixes.add(code[:i])
+    @property
+    def pending(self):
+        """True if the start of an escape sequence is waiting for more input."""
+        return bool(self._pending)
+
+    def timeout_remaining(self):
+        """Returns the seconds left before the pending input should be
+        flushed, or None if there isn't any pending input."""
+        if not self._pending:
+            return None
+        return max(0, self._pendingSince + self.esc_timeout - time.monotonic())
+
+    def feed(self, data):
+        """Adds `data` (bytes, or an already decoded str) to the input and
+        returns a list of the codes of the keys that are complete."""
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        text = self._pending + data
+        codes = []
+        i = 0
+        while i < len(text):
+            end = self._match(text, i)
+            if end is None:
+                break # The rest of the text could be the start of an escape sequence.
+            codes.append(text[i:end])
+            i = end
+
+        if i < len(text) and text[i:] != self._pending:
+            self._pendingSince = time.monotonic()
+        self._pending = text[i:]
+        return codes
+
+    def flush(self):
+        """Returns a list of the codes in the pending input, treating it as
+        complete. A lone esc character becomes the esc key."""
+        text = self._pending
+        self._pending = ''
+        codes = []
+        i = 0
+        while i < len(text):
+            end = self._match(text, i, final=True)
+            codes.append(text[i:end])
+            i = end
+        return codes
+
+    def _match(self, text, start, final=False):
+        """Returns the index just past the key code that begins at `start` in
+        `text`, or None if the code might continue past the end of `text`. If
+        `final` is True, the text is treated as complete."""
+        node = self._trie
+        end = None # The end of the longest code in the mapping found so far.
+        i = start
+        while i < len(text) and text[i] in node:
+            node = node[text[i]]
+            i += 1
+            if None in node:
+                end = i
+        if i == len(text) and len(node) > (None in node) and not final:
+            return None # This could be the start of a longer code.
+
+        if text.startswith('\x1b[', start):
+            # Keep unknown CSI sequences, like ones with modifiers, together:
+            i = start + 2
+            while i < len(text) and '0' <= text[i] <= '?':
+                i += 1 # Parameter characters.
+            if i < len(text) and '@' <= text[i] <= '~':
+                return i + 1 # The final character.
+            if i == len(text) and not final:
+                return None
+        if end is None:
+            return start + 1 # Not in the mapping, so it's just this character.
+        return end
+
+    def key_name(self, code):
+        """Returns the name of the key with the code `code`. Codes that aren't
+        in the mapping are returned as they are, except for CSI codes with
+        modifiers such as '\x1b[1;5A', which return names such as 'ctrl-up',
+        and mouse codes, which return a MouseEvent."""
+        if code in self.mapping:
+            return self.mapping[code]
+        if code.startswith('\x1b[') and ';' in code:
+            params, final = code[2:-1].split(';'), code[-1]
+            if len(params) == 2 and params[1].isdigit():
+                # '\x1b[1;5A' is the modified '\x1b[A', and '\x1b[3;5~' is '\x1b[3~':
+                baseCode = '\x1b[' + (params[0] if final == '~' else '') + final
+                if baseCode in self.mapping:
+                    modifiers = int(params[1]) - 1
+                    return ''.join(name for bit, name in _CSI_MODIFIERS if modifiers & bit) + self.mapping[baseCode]
+        return _parse_mouse_code(code) or code
 
 
 class GetKeyUnix(object):
     def __init__(self):
-        try:
-            self.__decoded_stream = OSReadWrapper()
-        except Exception as err:
-            raise BextException('Cannot use unix platform on non-file-like stream')
-
-    def get_key(self, blocking=True):
-        buffer = ''
-        for c in self.getcharsUnix(blocking):
-            buffer += c
-            if buffer not in unixPrefixes:
-                break
+        self._sessionDepth = 0 # How many session() with blocks are in progress.
+        self._keys = collections.deque() # The codes of keys that were read but not returned yet.
+        self._decoder = None # Built by the first get_key(), so importing bext stays fast.
 
-        if buffer == '\x03':
+    @property
+    def decoder(self):
+        """The KeyDecoder that turns the bytes read from stdin into key codes."""
+        if self._decoder is None:
+            self._decoder = KeyDecoder(unixCodeToNameMapping, sys.stdin.encoding)
+        return self._decoder
+
+    def get_key(self, blocking=True, timeout=None):
+        if not self._keys:
+            self.read_keys(blocking, timeout)
+        if not self._keys:
+            return ''  # In non-blocking mode or after the timeout, return '' if nothing was pressed.
+        return self._pop_key()
+
+    def wait_for_input(self, timeout=None):
+        """Returns True as soon as there is input to read, or False if there
+        is none after `timeout` seconds. Waits forever if `timeout` is None."""
+        if self._keys or self.decoder.pending:
+            return True
+        with self.context():
+            return bool(select.select([self.fileno()], [], [], timeout)[0])
+
+    def _queue_codes(self, codes):
+        """Adds the key codes in `codes` to the queue. A mouse motion event
+        replaces the one before it if nothing else came in between, so that
+        only the latest pointer position is kept."""
+        for code in codes:
+            if self._keys and _is_same_mouse_motion(self._keys[-1], code):
+                self._keys[-1] = code
+            else:
+                self._keys.append(code)
+
+    def _pop_key(self):
+        """Removes the next key from the queue and returns its name."""
+        code = self._keys.popleft()
+        if code == '\x03':
             raise KeyboardInterrupt
-        if buffer == '':
-            return ''  # In non-blocking mode, return '' if nothing was pressed.
-        return unixCodeToNameMapping.get(buffer, buffer)
+        return self.decoder.key_name(code)
+
+    async def get_key_async(self, timeout=None):
+        """The same as get_key(), but waits for input with the running asyncio
+        event loop instead of blocking. Returns '' if no key is pressed within
+        `timeout` seconds, or waits forever if `timeout` is None. The terminal
+        must already be in cbreak mode, such as with session()."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        fd = self.fileno()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not self._keys:
+            wait = None if deadline is None else max(0, deadline - loop.time())
+            if self.decoder.pending:
+                escWait = self.decoder.timeout_remaining()
+                wait = escWait if wait is None else min(wait, escWait)
+
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                loop.remove_reader(fd)
+
+            if readable.done() and not readable.cancelled():
+                self._queue_codes(self.decoder.feed(os.read(fd, 4096)))
+            elif self.decoder.pending and self.decoder.timeout_remaining() == 0:
+                self._queue_codes(self.decoder.flush())
+            elif deadline is not None and loop.time() >= deadline:
+                return ''
+        return self._pop_key()
+
+    def read_keys(self, blocking=True, timeout=None):
+        """Reads all of the input that's available with one read, splits it
+        into keys, and adds them to the queue that get_key() returns keys
+        from. If `blocking` is True, this waits until there is a key, or for
+        up to `timeout` seconds if `timeout` isn't None."""
+        fd = self.fileno()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.context():
+            while True:
+                if not blocking:
+                    wait = 0
+                else:
+                    wait = None if deadline is None else max(0, deadline - time.monotonic())
+                    if self.decoder.pending:
+                        escWait = self.decoder.timeout_remaining()
+                        wait = escWait if wait is None else min(wait, escWait)
+                if select.select([fd], [], [], wait)[0]:
+                    self._queue_codes(self.decoder.feed(os.read(fd, 4096)))
+                elif self.decoder.pending and self.decoder.timeout_remaining() == 0:
+                    self._queue_codes(self.decoder.flush())
+                elif not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    return
+                if self._keys:
+                    return
 
     def fileno(self):
-        return self.__decoded_stream.fileno()
+        return sys.stdin.fileno()
 
     @contextmanager
     def context(self):
+        if self._sessionDepth:
+            yield # session() has already put the terminal in cbreak mode.
+            return
         fd = self.fileno()
         old_settings = termios.tcgetattr(fd)
-        tty.setcbreak(fd)
+        tty.setcbreak(fd, termios.TCSANOW) # TCSANOW keeps keys pressed between calls.
         try:
             yield
         finally:
@@ -397,39 +650,26 @@ class GetKeyUnix(object):
                 fd, termios.TCSADRAIN, old_settings
             )
 
-    def getcharsUnix(self, blocking=True):
-        """Get characters on Unix."""
+    @contextmanager
+    def session(self):
+        """Keeps the terminal in cbreak mode until the with block ends, so
+        that get_key() doesn't switch the terminal mode on every call."""
         with self.context():
-            if blocking:
-                yield self.__decoded_stream.read(1)
-            while select.select([self.fileno()], [], [], 0)[0]:
-                yield self.__decoded_stream.read(1)
-
-
-class OSReadWrapper(object):
-    def __init__(self):
-        self.__decoder = codecs.getincrementaldecoder(sys.stdin.encoding)()
-
-    def fileno(self):
-        return sys.stdin.fileno()
-
-    @property
-    def buffer(self):
-        return sys.stdin.buffer
-
-    def read(self, chars):
-        buffer = ''
-        while len(buffer) < chars:
-            buffer += self.__decoder.decode(os.read(sys.stdin.fileno(), 1))
-        return buffer
+            self._sessionDepth += 1
+            try:
+                yield
+            finally:
+                self._sessionDepth -= 1
 
 
 class GetKeyWindows(object):
-    def get_key(self, blocking=True):
+    def get_key(self, blocking=True, timeout=None):
+        if blocking and timeout is not None and not self.wait_for_input(timeout):
+            return ''  # Nothing was pressed before the timeout.
         buffer = ''
         for c in self.getcharsWindows(blocking):
             buffer += c.decode(encoding=locale.getpreferredencoding())
-            if buffer not in windowsPrefixes:
+            if buffer not in _windows_prefixes():
                 break
 
         if buffer == '\x03':
@@ -438,6 +678,30 @@ class GetKeyWindows(object):
             return ''  # In non-blocking mode, return '' if nothing was pressed.
         return windowsCodeToNameMapping.get(buffer, buffer)
 
+    @contextmanager
+    def session(self):
+        """The Windows console doesn't need a mode change to read keys, so
+        this does nothing."""
+        yield
+
+    def wait_for_input(self, timeout=None):
+        """Returns True as soon as there is a key to read, or False if there
+        is none after `timeout` seconds. Waits forever if `timeout` is None."""
+        handle = ctypes.windll.kernel32.GetStdHandle(STD_INPUT_HANDLE)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not msvcrt.kbhit():
+            if deadline is None:
+                wait = INFINITE
+            else:
+                wait = int(max(0, deadline - time.monotonic()) * 1000)
+            # The console input handle is signaled by any input event, such
+            # as mouse and focus events, not just key presses:
+            if ctypes.windll.kernel32.WaitForSingleObject(handle, wait) != WAIT_OBJECT_0:
+                return msvcrt.kbhit()
+            if not msvcrt.kbhit():
+                time.sleep(0.01) # Give the non-key event time to be discarded.
+        return True
+
     def getcharsWindows(self, blocking=True):
         """Get characters on Windows."""
 
@@ -447,55 +711,840 @@ class GetKeyWindows(object):
             yield msvcrt.getch()
 
 
+def input_session():
+    """Returns a context manager that keeps the terminal ready to read single
+    keys until the with block ends. Calling get_key() in a loop is faster
+    inside of an input session, since the terminal mode is switched once
+    instead of on every call:
+
+    >>> with bext.input_session():
+    ...     while True:
+    ...         key = bext.get_key(blocking=False)
+
+    This only makes a difference on macOS and Linux."""
+    return _keyReader.session()
+
+
+# The thread started by start_input_thread(), the queue.Queue it puts keys
+# in, and the threading.Event that tells it to stop.
+_inputThread = None
+_inputQueue = None
+_stopInputThread = None
+
+_ARROW_KEYS = frozenset(('up', 'down', 'left', 'right'))
+
+
+def get_key(blocking=True, timeout=None):
+    """Waits until the user presses a single key on the keyboard, then
+    returns that key as a string. If `blocking` is False, this returns ''
+    right away if no key has been pressed. If `timeout` is given, this waits
+    at most that many seconds and returns '' if no key was pressed.
+
+    If the input thread is running (see start_input_thread()), the key is
+    taken from its queue."""
+    if _inputThread is None:
+        return _keyReader.get_key(blocking, timeout)
+    try:
+        return _inputQueue.get(blocking, timeout)
+    except queue.Empty:
+        return ''
+
+
+def wait_for_input(timeout=None):
+    """Waits until a key has been pressed and returns True, without reading
+    the key, or returns False if no key is pressed within `timeout` seconds.
+    If `timeout` is None, this waits forever. Nothing runs while waiting, so
+    this uses no CPU, unlike calling get_key(blocking=False) and time.sleep()
+    in a loop."""
+    if _inputThread is None:
+        return _keyReader.wait_for_input(timeout)
+    with _inputQueue.not_empty: # (This holds the queue's lock, so qsize() can't be used.)
+        return bool(_inputQueue.not_empty.wait_for(lambda: len(_inputQueue.queue), timeout))
+
+
+def start_input_thread():
+    """Starts a background thread that reads keys as soon as they're pressed
+    and puts them in a queue, so that keys aren't missed or delayed while the
+    program is busy drawing. Use poll_keys() to get all of the keys pressed
+    since the last call; get_key() and wait_for_input() also use the queue.
+    Pressing Ctrl-C raises KeyboardInterrupt in the main thread."""
+    global _inputThread, _inputQueue, _stopInputThread, queue
+    import queue, threading
+    if _inputThread is not None:
+        return
+    _inputQueue = queue.Queue()
+    _stopInputThread = threading.Event()
+    _inputThread = threading.Thread(target=_read_input_thread, args=(_inputQueue, _stopInputThread),
+                                    name='bext input', daemon=True)
+    _inputThread.start()
+    # Daemon threads are stopped without running their finally blocks when
+    # the program exits, so stop this one first to restore the terminal mode:
+    atexit.register(stop_input_thread)
+
+
+def stop_input_thread():
+    """Stops the thread started by start_input_thread(). Keys still in its
+    queue are dropped."""
+    global _inputThread
+    if _inputThread is None:
+        return
+    _stopInputThread.set()
+    _inputThread.join()
+    _inputThread = None
+    atexit.unregister(stop_input_thread)
+
+
+def _read_input_thread(keyQueue, stop):
+    """The body of the thread started by start_input_thread()."""
+    import _thread
+    with _keyReader.session():
+        while not stop.is_set():
+            try:
+                # The timeout lets the thread notice when it's told to stop.
+                key = _keyReader.get_key(timeout=0.1)
+            except KeyboardInterrupt:
+                _thread.interrupt_main()
+                continue
+            if key:
+                keyQueue.put(key)
+
+
+def poll_keys(merge_repeats=False):
+    """Returns a list of all of the keys read by the input thread (see
+    start_input_thread()) since the last call, without waiting. If
+    `merge_repeats` is True, repeated presses of the same arrow key in a row,
+    such as from holding it down, are merged into one. Mouse motion events in
+    a row are always merged, keeping only the latest position."""
+    if _inputThread is None:
+        raise BextException('poll_keys() requires start_input_thread() to be called first')
+    keys = []
+    while True:
+        try:
+            key = _inputQueue.get_nowait()
+        except queue.Empty:
+            return keys
+        if keys and _is_same_mouse_motion(keys[-1], key):
+            keys[-1] = key
+        elif not (merge_repeats and key in _ARROW_KEYS and keys and keys[-1] == key):
+            keys.append(key)
+
+
+async def get_key_async(timeout=None):
+    """Waits for a key to be pressed without blocking the running asyncio
+    event loop, then returns the key like get_key() does. Returns '' if no key
+    is pressed within `timeout` seconds, or waits forever if `timeout` is
+    None. This is only available on macOS and Linux."""
+    if currentPlatform != 'unix':
+        raise BextException('get_key_async() is only available on macOS and Linux')
+    with _keyReader.session():
+        return await _keyReader.get_key_async(timeout)
+
+
+async def keys():
+    """An asynchronous iterator of the keys that are pressed, for use with the
+    running asyncio event loop:
+
+    >>> async for key in bext.keys():
+    ...     print(key)
+
+    The terminal stays ready to read keys until the loop ends. This is only
+    available on macOS and Linux."""
+    with input_session():
+        while True:
+            yield await get_key_async()
+
+
+def enable_mouse(all_motion=False):
+    """Turns on mouse reporting, so that get_key() also returns MouseEvent
+    tuples for mouse button presses and releases, the wheel, and dragging.
+    If `all_motion` is True, moving the mouse without a button held down is
+    also reported. Motion events that arrive faster than the program reads
+    them are merged, so only the latest position is returned.
+
+    disable_mouse() is called automatically when the program exits, so that
+    the terminal doesn't keep sending mouse codes to the shell. This is only
+    available on macOS and Linux."""
+    if currentPlatform != 'unix':
+        raise BextException('enable_mouse() is only available on macOS and Linux')
+    # 1002 reports presses, releases, and dragging, and 1003 also reports
+    # motion without a button. 1006 uses the SGR format for the reports.
+    sys.stdout.write('\x1b[?%dh\x1b[?1006h' % (1003 if all_motion else 1002))
+    sys.stdout.flush()
+    atexit.unregister(disable_mouse) # Only register it once if this is called again.
+    atexit.register(disable_mouse)
+
+
+def disable_mouse():
+    """Turns off the mouse reporting turned on by enable_mouse()."""
+    if currentPlatform != 'unix':
+        return
+    sys.stdout.write('\x1b[?1003l\x1b[?1002l\x1b[?1006l')
+    sys.stdout.flush()
+    atexit.unregister(disable_mouse)
+
+
+def set_esc_timeout(seconds):
+    """Sets how long get_key() waits for the rest of an escape sequence after
+    an esc character before deciding that the esc key was pressed. The
+    default is 0.05 seconds; slow connections such as SSH over a laggy
+    network may need longer. This only makes a difference on macOS and
+    Linux."""
+    if currentPlatform == 'unix':
+        _keyReader.decoder.esc_timeout = seconds
+
+
+_coloramaInitialized = False # True if init() called colorama.init().
+_resetRegistered = False # True if init() registered _reset_at_exit().
+_ansiWriter = None # The _AnsiWriter that init() put in place of sys.stdout, if any.
+
+
+class _AnsiWriter(object):
+    """Stands in for sys.stdout on terminals that understand ANSI escape
+    codes. The text written to it is encoded and kept in a list, and then
+    written to the terminal's binary stream all at once when it's flushed,
+    when a newline is written, or when 8 KB have piled up (which is when
+    sys.stdout would write it too). This is much cheaper than passing each of
+    the many small writes that goto(), fg() and print() make through the text
+    layer of sys.stdout.
+
+    Each write is encoded right away, so that text that can't be encoded
+    raises an error from that write (like sys.stdout does) instead of from
+    every flush after it. A lock keeps writes and flushes from different
+    threads from losing or repeating text."""
+    __slots__ = ('_stream', '_parts', '_size', '_encoding', '_errors', '_lock')
+
+    def __init__(self, stream):
+        import _thread
+        self._lock = _thread.allocate_lock()
+        self._stream = stream
+        self._parts = []
+        self._size = 0 # The number of bytes in _parts.
+        self._encoding = stream.encoding
+        self._errors = stream.errors or 'strict'
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError('write() argument must be str, not ' + type(text).__name__)
+        data = text.encode(self._encoding, self._errors)
+        with self._lock:
+            self._parts.append(data)
+            self._size += len(data)
+            if self._size >= _ANSI_WRITER_BUFFER_SIZE or '\n' in text:
+                self._write_parts()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        with self._lock:
+            self._write_parts()
+
+    def _write_parts(self):
+        """Writes the buffered text to the terminal. The lock must be held."""
+        if not self._parts:
+            self._stream.flush()
+            return
+        data = b''.join(self._parts)
+        del self._parts[:]
+        self._size = 0
+        self._stream.flush() # Anything written to the real stdout comes first.
+        buffer = self._stream.buffer
+        buffer.write(data)
+        buffer.flush()
+
+    @property
+    def buffer(self):
+        self.flush() # So that bytes written to the buffer come after the text.
+        return self._stream.buffer
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name) # encoding, fileno(), isatty(), and so on.
+
+
+_ANSI_WRITER_BUFFER_SIZE = 8192
+
+
+def _stdout_is_tty():
+    """Returns True if sys.stdout is an open terminal."""
+    try:
+        return sys.stdout.isatty()
+    except (AttributeError, ValueError):
+        return False # sys.stdout is None, closed, or not a real file.
+
+
+def _reset_at_exit():
+    """Resets the colors when the program exits, the way colorama does."""
+    try:
+        if _ansiWriter is not None:
+            _ansiWriter.flush()
+        sys.__stdout__.write('\033[0m')
+        sys.__stdout__.flush()
+    except (AttributeError, ValueError, OSError):
+        pass # stdout is gone or already closed.
+
+
+def _enable_vt_processing():
+    """Returns True if the terminal that stdout writes to understands ANSI
+    escape codes, turning them on first in the Windows console."""
+    if currentPlatform == 'unix':
+        return True
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
+    mode = ctypes.c_ulong()
+    if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+        return False
+    if mode.value & ENABLE_VIRTUAL_TERMINAL_PROCESSING:
+        return True
+    # This fails on versions of Windows before Windows 10.
+    return bool(kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING))
+
+
 def init():
     """This sets up stdout to work in color. This function is automatically
-    called when Bext is imported."""
+    called when Bext is imported.
+
+    If stdout is a terminal that understands ANSI escape codes, sys.stdout is
+    replaced with a faster writer that sends text straight to the terminal.
+    Otherwise, Colorama converts the escape codes for the Windows console or
+    strips them from output that isn't going to a terminal."""
+    global _coloramaInitialized, _resetRegistered, _ansiWriter, goto
+    reset_color_state()
+    if _ansiWriter is not None or _coloramaInitialized:
+        return # init() was already called.
+
+    if _stdout_is_tty() and hasattr(sys.stdout, 'buffer') and _enable_vt_processing():
+        sys.stdout.flush()
+        _ansiWriter = _AnsiWriter(sys.stdout)
+        sys.stdout = _ansiWriter
+        goto = _goto_control_code # The Windows console API would move the cursor before buffered text is written.
+        if not _resetRegistered:
+            atexit.register(_reset_at_exit)
+            _resetRegistered = True
+        return
+
+    import colorama
     colorama.init()
+    _coloramaInitialized = True
 
 def deinit():
-    """This calls Colorama's deinit() function, in case you need to undo init()."""
-    colorama.deinit()
+    """This undoes init(), putting back the sys.stdout that was there before."""
+    global _coloramaInitialized, _ansiWriter
+    reset_color_state()
+    if _ansiWriter is not None:
+        _ansiWriter.flush()
+        if sys.stdout is _ansiWriter:
+            sys.stdout = _ansiWriter._stream
+        _ansiWriter = None
+    if _coloramaInitialized:
+        import colorama
+        colorama.deinit()
+        _coloramaInitialized = False
+
+
+# The stream that sys.stdout was before batch() replaced it, or None if a
+# batch isn't in progress.
+_batchedStdout = None
+
+
+# Terminals that support synchronized output (DEC private mode 2026) don't
+# redraw the window between these codes, so a frame appears all at once
+# instead of tearing. Other terminals ignore them.
+_BEGIN_SYNCHRONIZED_UPDATE = '\x1b[?2026h'
+_END_SYNCHRONIZED_UPDATE = '\x1b[?2026l'
+
+# Whether the terminal supports synchronized output, or None if it hasn't
+# been asked yet.
+_synchronizedOutputSupported = None
+
+
+def synchronized_output_supported(timeout=0.1):
+    """Returns True if the terminal reports that it supports synchronized
+    output (DEC private mode 2026), which batch(sync=True) and
+    Screen.update(sync=True) use. The terminal is asked with a DECRQM query
+    the first time this is called, waiting up to `timeout` seconds for the
+    answer, and the answer is remembered. Returns False if stdin or stdout
+    isn't a terminal, as when a program's output is redirected, and returns
+    False without asking (or remembering) while start_input_thread()'s thread
+    is reading stdin."""
+    global _synchronizedOutputSupported
+    if _synchronizedOutputSupported is None:
+        if _inputThread is not None:
+            return False # The input thread would read the answer as keys.
+        response = _query_terminal('\x1b[?2026$p', rb'\x1b\[\?2026;[0-9]*\$y', timeout)
+        # The response is CSI ? 2026 ; Ps $ y, where Ps is 1 (set) or 2 (reset)
+        # if the mode is supported, and 0 (unknown) or 4 (always reset) if not.
+        _synchronizedOutputSupported = response.endswith((b'2026;1$y', b'2026;2$y'))
+    return _synchronizedOutputSupported
+
+
+def _query_terminal(query, pattern, timeout):
+    """Writes the escape code `query` to the terminal and returns the bytes of
+    its response, which match the regular expression `pattern`. Returns b''
+    if there's no response or if this isn't a Unix terminal.
+
+    A primary device attributes (DA1) query is sent after `query`. Every
+    terminal answers DA1, and terminals answer in order, so once the DA1
+    answer arrives any answer to `query` has too, and this doesn't have to
+    wait out the `timeout` seconds. Keys pressed while waiting are queued for
+    get_key() instead of being thrown away. Returns b'' without asking while
+    start_input_thread()'s thread is reading stdin."""
+    if currentPlatform != 'unix' or not (sys.stdin.isatty() and sys.stdout.isatty()):
+        return b''
+    if _inputThread is not None:
+        return b'' # The input thread would read the response as keys.
+
+    import re
+    fd = sys.stdin.fileno()
+    with _keyReader.context():
+        sys.stdout.write(query + '\x1b[c')
+        sys.stdout.flush()
+        received = b''
+        deadline = time.monotonic() + timeout
+        while True:
+            da1 = re.search(rb'\x1b\[\?[0-9;]*c', received)
+            if da1 is not None:
+                received = received[:da1.start()] + received[da1.end():]
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                # Drop the start of an answer that didn't finish arriving:
+                received = re.sub(rb'\x1b(\[(\?[0-9;$]*)?)?$', b'', received)
+                break
+            received += os.read(fd, 4096)
+
+    response = re.search(pattern, received)
+    if response is not None:
+        received = received[:response.start()] + received[response.end():]
+    if received:
+        _keyReader._queue_codes(_keyReader.decoder.feed(received))
+    return b'' if response is None else response.group()
+
+
+def _synchronized(text, sync):
+    """Returns `text` wrapped in the synchronized output codes if `sync` is
+    True, or if `sync` is None and the terminal supports them."""
+    if not text or sync is False or (sync is None and not synchronized_output_supported()):
+        return text
+    return _BEGIN_SYNCHRONIZED_UPDATE + text + _END_SYNCHRONIZED_UPDATE
+
+
+@contextmanager
+def batch(sync=False):
+    """A context manager that collects everything written to stdout, including
+    by goto(), fg(), bg(), clear(), title(), print() and Screen.update(), in
+    memory and writes it to the terminal with a single write and flush at the
+    end of the with block. This avoids thousands of small writes when drawing
+    a frame with many calls:
+
+    >>> with bext.batch():
+    ...     for x, y in points:
+    ...         bext.goto(x, y)
+    ...         print('*', end='')
+
+    If `sync` is True, the output is wrapped in synchronized output codes so
+    that the terminal shows it all at once instead of redrawing partway
+    through (terminals that don't support this ignore the codes). If `sync`
+    is None, the codes are only used if synchronized_output_supported().
+
+    Nested batches are part of the outermost batch."""
+    global _batchedStdout
+    if _batchedStdout is not None:
+        yield # Already in a batch; the outer batch writes everything.
+        return
+
+    _batchedStdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        yield
+    finally:
+        text = sys.stdout.getvalue()
+        sys.stdout = _batchedStdout
+        _batchedStdout = None
+        sys.stdout.write(_synchronized(text, sync))
+        sys.stdout.flush()
+
+
+frame = batch # An alias for batch(), for programs that draw one frame per with block.
+
+
+# The measured time in seconds between the last two frames drawn by run().
+_frameTime = None
+
+
+def frame_time():
+    """Returns the measured time in seconds between the last two frames
+    drawn by run() or Screen.loop(), or None if fewer than two frames have
+    been drawn. The frame rate is 1 / frame_time()."""
+    return _frameTime
+
+
+def run(update_fn, fps=30, render_fn=None, max_frame_skip=5, sync=False):
+    """Runs a game loop that calls `update_fn(dt)` `fps` times a second,
+    where `dt` is always 1 / fps, followed by `render_fn()` if it's given.
+    The loop ends when `update_fn` returns False.
+
+    The loop is timed with a monotonic clock so it doesn't drift. If a frame
+    takes too long, the next updates are called right away without calling
+    `render_fn` to catch up, but no more than `max_frame_skip` in a row.
+    Each frame's output is written with batch(sync=sync). Use frame_time() to
+    get the measured time between frames."""
+    global _frameTime
+    if fps <= 0:
+        raise BextException('fps must be greater than 0')
+    dt = 1 / fps
+    _frameTime = None
+    lastFrame = None
+    skippedFrames = 0
+    nextUpdate = time.monotonic()
+    while True:
+        with batch(sync):
+            if update_fn(dt) is False:
+                return
+            nextUpdate += dt
+            now = time.monotonic()
+            if now > nextUpdate:
+                if skippedFrames < max_frame_skip:
+                    skippedFrames += 1
+                    continue # Running late, so update again without rendering.
+                nextUpdate = now # Too far behind to catch up, so stop trying.
+            skippedFrames = 0
+
+            if render_fn is not None:
+                render_fn()
+        if lastFrame is not None:
+            _frameTime = now - lastFrame
+        lastFrame = now
+
+        delay = nextUpdate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# The SGR ("Select Graphic Rendition") parameters for each color name:
+_FG_PARAMS = {'black': '30', 'red': '31', 'green': '32', 'yellow': '33', 'blue': '34',
+              'magenta': '35', 'purple': '35', 'cyan': '36', 'white': '37', 'reset': '39'}
+_BG_PARAMS = {'black': '40', 'red': '41', 'green': '42', 'yellow': '43', 'blue': '44',
+              'magenta': '45', 'purple': '45', 'cyan': '46', 'white': '47', 'reset': '49'}
+
+# The (red, green, blue) values of the xterm 256-color palette: 0 to 7 are the
+# colors in ALL_COLORS, 8 to 15 are their bright versions, 16 to 231 are a
+# 6 x 6 x 6 color cube, and 232 to 255 are shades of gray.
+_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+_PALETTE_256 = (((0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+                 (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+                 (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+                 (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255)) +
+                tuple((r, g, b) for r in _CUBE_LEVELS for g in _CUBE_LEVELS for b in _CUBE_LEVELS) +
+                tuple((v, v, v) for v in range(8, 248, 10)))
+
+# The SGR parameters for each palette index. The first 16 use the short codes
+# that Colorama can also convert on Windows.
+_FG_INDEX_PARAMS = (tuple(str(30 + i) for i in range(8)) + tuple(str(90 + i) for i in range(8)) +
+                    tuple('38;5;%d' % i for i in range(16, 256)))
+_BG_INDEX_PARAMS = (tuple(str(40 + i) for i in range(8)) + tuple(str(100 + i) for i in range(8)) +
+                    tuple('48;5;%d' % i for i in range(16, 256)))
+
+TRUECOLOR = 256 ** 3 # The number of colors with 24-bit color.
+
+# The number of colors the terminal supports, or None to guess it.
+_colorDepth = None
+# For each palette index, the index of the closest of the first 8 colors.
+_indexesTo8 = None
+
+
+def color_depth():
+    """Returns the number of colors the terminal supports: 8, 256, or
+    TRUECOLOR (24-bit color). Unless set with set_color_depth(), this is a
+    guess based on the COLORTERM and TERM environment variables. Colors that
+    the terminal doesn't support are replaced by the closest supported
+    color."""
+    global _colorDepth
+    if _colorDepth is None:
+        if sys.platform == 'win32':
+            _colorDepth = 8 # Colorama can only convert the basic colors.
+        elif os.environ.get('COLORTERM', '').lower() in ('truecolor', '24bit'):
+            _colorDepth = TRUECOLOR
+        elif '256color' in os.environ.get('TERM', ''):
+            _colorDepth = 256
+        else:
+            _colorDepth = 8
+    return _colorDepth
+
+
+def set_color_depth(colors):
+    """Sets the number of colors the terminal supports to 8, 256, or
+    TRUECOLOR, or None to guess it again. See color_depth()."""
+    global _colorDepth
+    if colors not in (8, 256, TRUECOLOR, None):
+        raise BextException('colors must be 8, 256, or bext.TRUECOLOR, not ' + repr(colors))
+    _colorDepth = colors
+
+
+def _nearest_8(r, g, b):
+    """Returns the index of the color in ALL_COLORS closest to `r`, `g`, `b`."""
+    distances = [(r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2 for pr, pg, pb in _PALETTE_256[:8]]
+    return distances.index(min(distances))
+
+
+def _cube_level(value):
+    """Returns the index in _CUBE_LEVELS closest to the color value `value`."""
+    return 0 if value < 48 else 1 if value < 115 else (value - 35) // 40
+
+
+def quantize(rgb, colors=256):
+    """Returns the index in the 256-color palette (or, if `colors` is 8, in
+    ALL_COLORS) of the color closest to `rgb`, which is a (red, green, blue)
+    tuple of ints from 0 to 255.
+
+    If `rgb` is a NumPy array of shape (..., 3), the closest colors are found
+    with vectorized operations and returned as an array of uint8 indexes."""
+    if colors not in (8, 256):
+        raise BextException('colors must be 8 or 256, not ' + repr(colors))
+    if not isinstance(rgb, (tuple, list)):
+        return _quantize_numpy(rgb, colors)
+
+    r, g, b = rgb
+    if colors == 8:
+        return _nearest_8(r, g, b)
+
+    # Compare the closest color in the color cube to the closest gray:
+    cubeIndex = 16 + 36 * _cube_level(r) + 6 * _cube_level(g) + _cube_level(b)
+    grayIndex = 232 + min(max((r + g + b) // 3 - 3, 0) // 10, 23)
+    cr, cg, cb = _PALETTE_256[cubeIndex]
+    gray = _PALETTE_256[grayIndex][0]
+    if (r - gray) ** 2 + (g - gray) ** 2 + (b - gray) ** 2 < (r - cr) ** 2 + (g - cg) ** 2 + (b - cb) ** 2:
+        return grayIndex
+    return cubeIndex
+
+
+def _quantize_numpy(rgb, colors):
+    """The same as quantize(), for a NumPy array of (red, green, blue) colors."""
+    numpy = _import_numpy()
+    rgb = numpy.asarray(rgb, dtype=numpy.int32)
+    if rgb.shape[-1:] != (3,):
+        raise BextException('rgb must have a last dimension of 3, not shape ' + repr(rgb.shape))
+    palette = numpy.array(_PALETTE_256, dtype=numpy.int32)
+    if colors == 8:
+        distances = ((rgb[..., numpy.newaxis, :] - palette[:8]) ** 2).sum(axis=-1)
+        return distances.argmin(axis=-1).astype(numpy.uint8)
+
+    levels = numpy.where(rgb < 48, 0, numpy.where(rgb < 115, 1, (rgb - 35) // 40))
+    cubeIndexes = 16 + 36 * levels[..., 0] + 6 * levels[..., 1] + levels[..., 2]
+    grayIndexes = 232 + numpy.minimum(numpy.maximum(rgb.sum(axis=-1) // 3 - 3, 0) // 10, 23)
+    cubeDistances = ((rgb - palette[cubeIndexes]) ** 2).sum(axis=-1)
+    grayDistances = ((rgb - palette[grayIndexes]) ** 2).sum(axis=-1)
+    return numpy.where(grayDistances < cubeDistances, grayIndexes, cubeIndexes).astype(numpy.uint8)
+
+
+def _as_int(value):
+    """Returns `value` as an int if it's an integer, including NumPy's integer
+    types such as the ones quantize() returns, or None if it isn't. Bools
+    aren't counted as integers."""
+    if isinstance(value, bool):
+        return None
+    try:
+        return operator.index(value)
+    except TypeError:
+        return None
+
+
+def _parse_rgb(color):
+    """Returns the (red, green, blue) tuple for `color`, which is a tuple of
+    three ints from 0 to 255 or a '#rrggbb' or '#rgb' hex string."""
+    if isinstance(color, str):
+        hexDigits = color[1:]
+        if len(hexDigits) == 3:
+            hexDigits = ''.join(digit * 2 for digit in hexDigits)
+        try:
+            if not color.startswith('#') or len(hexDigits) != 6:
+                raise ValueError
+            return (int(hexDigits[0:2], 16), int(hexDigits[2:4], 16), int(hexDigits[4:6], 16))
+        except ValueError:
+            raise BextException('Unknown color: ' + repr(color))
+
+    try:
+        rgb = tuple(_as_int(value) for value in color)
+    except TypeError:
+        raise BextException('Unknown color: ' + repr(color)) # Not a string, int, or sequence.
+    if len(rgb) != 3 or not all(value is not None and 0 <= value <= 255 for value in rgb):
+        raise BextException('RGB colors must be three ints from 0 to 255, not ' + repr(color))
+    return rgb
+
+
+def _index_param(index, background=False):
+    """Returns the SGR parameter for the palette index `index`, replaced by
+    the closest of the 8 basic colors if the terminal only supports those."""
+    if color_depth() == 8:
+        global _indexesTo8
+        if _indexesTo8 is None:
+            _indexesTo8 = bytes(list(range(8)) + list(range(8)) +
+                                [_nearest_8(*rgb) for rgb in _PALETTE_256[16:]])
+        index = _indexesTo8[index]
+    return (_BG_INDEX_PARAMS if background else _FG_INDEX_PARAMS)[index]
+
+
+@functools.lru_cache(maxsize=4096)
+def _rgb_param(r, g, b, background=False):
+    """Returns the SGR parameter for a 24-bit color. The most recently used
+    colors are cached, since gradients tend to reuse the same colors."""
+    return '%d;2;%d;%d;%d' % (48 if background else 38, r, g, b)
+
+
+# The SGR parameters of the [foreground, background] colors last written to
+# the terminal, or None if they aren't known. These let bext skip escape codes
+# for colors that are already set.
+_sgrState = [None, None]
+
+
+def _sgr_code(fgParam=None, bgParam=None, state=_sgrState):
+    """Returns the escape code that sets the foreground and background colors
+    to the SGR parameters `fgParam` and `bgParam`, combined into one code.
+    Colors that are None or already set in `state` are left out, and if
+    neither color needs to change, this returns ''. The `state` list is
+    updated to the new colors."""
+    params = []
+    if fgParam is not None and fgParam != state[0]:
+        params.append(fgParam)
+        state[0] = fgParam
+    if bgParam is not None and bgParam != state[1]:
+        params.append(bgParam)
+        state[1] = bgParam
+    if not params:
+        return ''
+    return '\033[' + ';'.join(params) + 'm'
+
+
+def reset_color_state():
+    """Forgets which colors bext set last, so that the next fg(), bg(),
+    colors(), or Screen.update() writes its color codes even if they look
+    like they're already set. Call this after colors are changed without
+    bext, for example by printing '\\033[0m' or running a subprocess."""
+    _sgrState[0] = _sgrState[1] = None
+
+
+def _is_reset(color):
+    """Returns True if `color` is the 'reset' color."""
+    return isinstance(color, str) and color.lower() == 'reset'
+
+
+def _color_param(color, background=False):
+    """Returns the foreground (or background) SGR parameter for `color`,
+    which can be any of the colors that fg() takes."""
+    if isinstance(color, str):
+        name = color.lower()
+        if name == 'random':
+            import random
+            name = random.choice(ALL_COLORS)
+        params = _BG_PARAMS if background else _FG_PARAMS
+        if name in params:
+            return params[name]
+    elif _as_int(color) is not None:
+        index = _as_int(color)
+        if not 0 <= index <= 255:
+            raise BextException('Palette colors must be from 0 to 255, not ' + repr(color))
+        return _index_param(index, background)
+
+    r, g, b = _parse_rgb(color)
+    depth = color_depth()
+    if depth == TRUECOLOR:
+        return _rgb_param(r, g, b, background)
+    return _index_param(quantize((r, g, b), depth), background)
+
 
 def fg(color):
     """Sets the foreground color. The `color` parameter can be one of the
     following strings: 'black', 'red', 'green', 'yellow', 'blue', 'purple',
-    'cyan', 'white', 'reset'."""
-    color = color.lower()
-    if color == 'random':
-        color = random.choice(ALL_COLORS)
-
-    color = {'black':   colorama.Fore.BLACK,
-             'red':     colorama.Fore.RED,
-             'green':   colorama.Fore.GREEN,
-             'yellow':  colorama.Fore.YELLOW,
-             'blue':    colorama.Fore.BLUE,
-             'magenta': colorama.Fore.MAGENTA,
-             'purple':  colorama.Fore.MAGENTA,
-             'cyan':    colorama.Fore.CYAN,
-             'white':   colorama.Fore.WHITE,
-             'reset':   colorama.Fore.RESET}[color]
-    sys.stdout.write(color)
+    'cyan', 'white', 'reset', 'random'. It can also be an int from 0 to 255
+    for the 256-color palette, or an RGB color as a (red, green, blue) tuple
+    or a '#rrggbb' string. Colors the terminal doesn't support are replaced by
+    the closest one it does (see color_depth()). Nothing is written if the
+    color is already set, except for 'reset', which is always written in case
+    the color was changed without bext (see reset_color_state())."""
+    if _is_reset(color):
+        _sgrState[0] = None
+    sys.stdout.write(_sgr_code(fgParam=_color_param(color)))
 
 
 def bg(color):
-    """Sets the background color. The `color` parameter can be one of the
-    following strings: 'black', 'red', 'green', 'yellow', 'blue', 'purple',
-    'cyan', 'white', 'reset'."""
-    color = color.lower()
-    if color == 'random':
-        color = random.choice(ALL_COLORS)
-
-    color = {'black':   colorama.Back.BLACK,
-             'red':     colorama.Back.RED,
-             'green':   colorama.Back.GREEN,
-             'yellow':  colorama.Back.YELLOW,
-             'blue':    colorama.Back.BLUE,
-             'magenta': colorama.Back.MAGENTA,
-             'purple':  colorama.Back.MAGENTA,
-             'cyan':    colorama.Back.CYAN,
-             'white':   colorama.Back.WHITE,
-             'reset':   colorama.Back.RESET}[color]
-    sys.stdout.write(color)
+    """Sets the background color. Takes the same colors as fg(). Nothing is
+    written if the color is already set, except for 'reset'."""
+    if _is_reset(color):
+        _sgrState[1] = None
+    sys.stdout.write(_sgr_code(bgParam=_color_param(color, background=True)))
+
+
+def colors(fg=None, bg=None):
+    """Sets the foreground and background colors with a single escape code.
+    Either can be None to leave that color as it is. Takes the same colors as
+    fg() and bg()."""
+    if _is_reset(fg):
+        _sgrState[0] = None
+    if _is_reset(bg):
+        _sgrState[1] = None
+    fgParam = None if fg is None else _color_param(fg)
+    bgParam = None if bg is None else _color_param(bg, background=True)
+    sys.stdout.write(_sgr_code(fgParam, bgParam))
+
+
+def _cursor_move_code(fromx, fromy, tox, toy, gap=None):
+    """Returns the shortest string that moves the cursor from `fromx`,
+    `fromy` to `tox`, `toy`. Pass None for `fromx` and `fromy` if the current
+    cursor position isn't known, in which case the absolute position code is
+    used.
+
+    If `gap` is given, it's the text already on the screen from `fromx` up
+    to `tox` on the same row, drawn in the current colors. Rewriting it is
+    one of the candidate moves.
+
+    (0, 0) is the top-left corner coordinate."""
+    if fromx == tox and fromy == toy:
+        return ''
+
+    # Absolute position (CUP), leaving out parameters that are 1:
+    if tox == 0 and toy == 0:
+        best = '\x1b[H'
+    elif tox == 0:
+        best = '\x1b[%dH' % (toy + 1)
+    else:
+        best = '\x1b[%d;%dH' % (toy + 1, tox + 1)
+    if fromx is None or fromy is None:
+        return best
+
+    # Relative moves: an optional vertical move then a horizontal move.
+    # (A carriage return followed by a line feed moves to the start of the
+    # next row even if the terminal turns the line feed into CR LF.)
+    dy = toy - fromy
+    if dy == 1 and tox == 0:
+        candidates = ['\r\n']
+    else:
+        if dy == 0:
+            vertical = ''
+        elif dy > 0:
+            vertical = '\x1b[B' if dy == 1 else '\x1b[%dB' % dy
+        else:
+            vertical = '\x1b[A' if dy == -1 else '\x1b[%dA' % -dy
+
+        dx = tox - fromx
+        if dx == 0:
+            horizontals = ['']
+        elif dx > 0:
+            horizontals = ['\x1b[C' if dx == 1 else '\x1b[%dC' % dx]
+            if gap is not None and dy == 0 and len(gap) == dx:
+                horizontals.append(gap)
+        else:
+            horizontals = ['\x1b[D' if dx == -1 else '\x1b[%dD' % -dx, '\b' * -dx]
+        if tox == 0:
+            horizontals.append('\r')
+        elif dx != 0:
+            horizontals.append('\r\x1b[C' if tox == 1 else '\r\x1b[%dC' % tox)
+        candidates = [vertical + horizontal for horizontal in horizontals]
+
+    for candidate in candidates:
+        if len(candidate.encode('utf-8')) < len(best):
+            best = candidate
+    return best
 
 
 def _goto_control_code(x, y):
@@ -507,7 +1556,7 @@ def _goto_control_code(x, y):
     if y < 0:
         raise BextException('y coordinate is negative')
 
-    width, height = shutil.get_terminal_size()
+    width, height = size()
 
     if x >= width:
         raise BextException('x coordinate is greater than terminal width ' + str(width))
@@ -526,13 +1575,18 @@ def _goto_win32_api(x, y):
     if y < 0:
         raise BextException('y coordinate is negative')
 
-    width, height = shutil.get_terminal_size()
+    width, height = size()
 
     if x >= width:
         raise BextException('x coordinate is greater than terminal width ' + str(width))
     if y >= height:
         raise BextException('y coordinate is greater than terminal height ' + str(height))
 
+    if _batchedStdout is not None:
+        # Moving the cursor now would happen before the batched text is
+        # written, so let Colorama convert the escape code when the batch ends.
+        sys.stdout.write('\x1b[%d;%dH' % (y + 1, x + 1))
+        return
     h = ctypes.windll.kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
     ctypes.windll.kernel32.SetConsoleCursorPosition(h, COORD(x, y))
 
@@ -543,32 +1597,149 @@ def resize(columns, rows):
     if sys.platform == 'win32':
         # This is only on Windows 7 and later.
         os.system('mode %s,%s' % (columns, rows))
+        _forget_size()
         return size() == (columns, rows)
         # TODO - figure out a way to detect windows 7. (There seems to be some problems with platform.platform())
     else:
         sys.stdout.write("\x1b[8;{rows};{cols}t".format(rows=32, cols=columns))
         #os.system('resize -s %s %s' % (rows, columns))
+        _forget_size()
         return size() == (columns, rows)
 
 
+# The terminal size from the last size() call. This is only cached on
+# platforms with SIGWINCH, which tells us when the terminal is resized.
+_terminalSize = None
+_resizeCallbacks = []
+_sigwinchInstalled = False
+_previousSigwinchHandler = None
+
+
+def _forget_size():
+    """Makes the next size() call ask the terminal for its size again."""
+    global _terminalSize
+    _terminalSize = None
+
+
+def _on_sigwinch(signum, frame):
+    """The SIGWINCH handler, which is called when the terminal is resized."""
+    _forget_size()
+    if _resizeCallbacks:
+        columns, rows = size()
+        for callback in list(_resizeCallbacks):
+            callback(columns, rows)
+    if callable(_previousSigwinchHandler):
+        _previousSigwinchHandler(signum, frame)
+
+
+def _install_sigwinch_handler():
+    """Installs the SIGWINCH handler, if this platform and thread can."""
+    global _sigwinchInstalled, _previousSigwinchHandler
+    import signal
+    if _sigwinchInstalled or not hasattr(signal, 'SIGWINCH'):
+        return
+    try:
+        _previousSigwinchHandler = signal.signal(signal.SIGWINCH, _on_sigwinch)
+    except ValueError:
+        return # Signal handlers can only be installed from the main thread.
+    _sigwinchInstalled = True
+
+
+def _size_cache_valid():
+    """Returns True if bext's SIGWINCH handler, which clears the cached size,
+    is still installed. The program (or curses) may have replaced it."""
+    import signal
+    return _sigwinchInstalled and signal.getsignal(signal.SIGWINCH) is _on_sigwinch
+
+
+def on_resize(callback):
+    """Registers `callback` to be called with the new (columns, rows) whenever
+    the terminal is resized. Returns `callback`, so this can be used as a
+    decorator. This only works on platforms with SIGWINCH (macOS and Linux).
+
+    This installs a SIGWINCH handler, which also calls the handler that was
+    installed before it. If the program installs another SIGWINCH handler
+    afterwards, the callbacks stop being called unless it calls bext's."""
+    _install_sigwinch_handler()
+    _resizeCallbacks.append(callback)
+    return callback
+
+
 def size():
-    """Returns the size of the terminal as a named tuple of two ints: (columns, rows)"""
-    return shutil.get_terminal_size()
+    """Returns the size of the terminal as a named tuple of two ints: (columns, rows)
+
+    On macOS and Linux, the first call installs a SIGWINCH handler (which also
+    calls the handler that was installed before it), and the size is cached
+    until the terminal is resized. If the program replaces the handler with
+    its own, the size is asked for on every call instead."""
+    global _terminalSize
+    if _terminalSize is not None and _size_cache_valid():
+        return _terminalSize
+
+    import shutil
+    _install_sigwinch_handler()
+    terminalSize = shutil.get_terminal_size()
+    _terminalSize = terminalSize if _size_cache_valid() else None
+    return terminalSize
 
 
 def width():
     """Returns the width of the terminal in columns as an int."""
-    return shutil.get_terminal_size()[0]
+    return size()[0]
 
 
 def height():
     """Returns the height of the terminal in rows as an int."""
-    return shutil.get_terminal_size()[1]
+    return size()[1]
+
+
+def plot(points, char='\u2588', fg=None, bg=None):
+    """Draws `char` at every (x, y) point in the iterable `points`, with a
+    single write to the terminal. The points can be tuples, lists, or the rows
+    of an N x 2 NumPy array. (For separate sequences of x and y coordinates,
+    pass zip(xs, ys).) The points are checked against the
+    terminal size once and drawn in top-to-bottom, left-to-right order so that
+    the cursor moves between them are short. The `fg` and `bg` colors are
+    set first if given.
+
+    (0, 0) is the top-left corner coordinate."""
+    points = sorted(set((int(x), int(y)) for x, y in points), key=lambda point: (point[1], point[0]))
+    if not points:
+        return
+
+    terminalWidth, terminalHeight = size()
+    if points[0][1] < 0 or points[-1][1] >= terminalHeight:
+        raise BextException('y coordinate is outside the terminal height ' + str(terminalHeight))
+    xs = [x for x, y in points]
+    if min(xs) < 0 or max(xs) >= terminalWidth:
+        raise BextException('x coordinate is outside the terminal width ' + str(terminalWidth))
+
+    output = []
+    if fg is not None or bg is not None:
+        output.append(_sgr_code(None if fg is None else _color_param(fg),
+                                None if bg is None else _color_param(bg, background=True)))
+    cursorx = cursory = None # The cursor position is unknown until the first move.
+    for x, y in points:
+        output.append(_cursor_move_code(cursorx, cursory, x, y))
+        output.append(char)
+        cursorx = x + 1
+        cursory = y
+        if cursorx >= terminalWidth:
+            cursorx = cursory = None # The cursor is in the "pending wrap" state.
+
+    sys.stdout.write(''.join(output))
+    sys.stdout.flush()
+
+
+def erase(points):
+    """Draws a space at every (x, y) point in the iterable `points`, in the
+    current background color. See plot()."""
+    plot(points, ' ')
 
 
 def clear(mode=2):  # TODO - what does mode mean?
     """Clears the terminal and positions the cursor at the top-left corner."""
-    sys.stdout.write(colorama.ansi.CSI + str(mode) + 'J')
+    sys.stdout.write('\033[' + str(mode) + 'J')
     # On macOS and Linux, clearing doesn't reset the cursor back to the top-left
     # corner of the termnal window, so do that here:
     goto(0, 0)
@@ -576,13 +1747,13 @@ def clear(mode=2):  # TODO - what does mode mean?
 
 def clear_line(mode=2):  # TODO - what does mode mean? This was copied from clear()
     """Clears the current line and positions the cursor at the start of the current line."""
-    sys.stdout.write(colorama.ansi.CSI + str(mode) + 'K')
-    #sys.stdout.write(colorama.ansi.CSI + str(mode) + '1;1H')
+    sys.stdout.write('\033[' + str(mode) + 'K')
+    #sys.stdout.write('\033[' + str(mode) + '1;1H')
     sys.stdout.write('\b' * 300) # TODO - fix this with the real control code
 
 def title(text):
     """Sets the title of the terminal window to `text`."""
-    sys.stdout.write(colorama.ansi.OSC + '2;' + text + colorama.ansi.BEL)
+    sys.stdout.write('\033]2;' + text + '\a')
 
 
 def hide_cursor():
@@ -616,9 +1787,7 @@ def show_cursor():
 
 
 # https://en.wikipedia.org/wiki/Windows_Glyph_List_4
-allChrs = {}
-allOrds = {}
-for _start, _stop in ((0x21, 0x7f), (0xa1, 0x180), (0x192, 0x193), (0x1fa, 0x200), (0x2c6, 0x2c8), (0x2c9, 0x2ca),
+_WGL4_RANGES = ((0x21, 0x7f), (0xa1, 0x180), (0x192, 0x193), (0x1fa, 0x200), (0x2c6, 0x2c8), (0x2c9, 0x2ca),
     (0x2d8, 0x2de), (0x384, 0x38b), (0x38c, 0x38d), (0x38e, 0x3a2), (0x3a3, 0x3cf), (0x400, 0x492), (0x1e80, 0x1e86),
     (0x1ef2, 0x1ef4), (0x2013, 0x2016), (0x2017, 0x201f), (0x2020, 0x2023), (0x2026, 0x2027), (0x2030, 0x2031),
     (0x2032, 0x2034), (0x2039, 0x203b), (0x203c, 0x203d), (0x203e, 0x203f), (0x2044, 0x2045), (0x207f, 0x2080),
@@ -632,10 +1801,24 @@ for _start, _stop in ((0x21, 0x7f), (0xa1, 0x180), (0x192, 0x193), (0x1fa, 0x200
     (0x258c, 0x258d), (0x2590, 0x2594), (0x25a0, 0x25a2), (0x25aa, 0x25ad), (0x25b4, 0x25b5), (0x25ba, 0x25bb),
     (0x25bc, 0x25bd), (0x25c4, 0x25c5), (0x25ca, 0x25cc), (0x25cf, 0x25d0), (0x25d8, 0x25da), (0x25e6, 0x25e7),
     (0x263a, 0x263d), (0x2640, 0x2641), (0x2642, 0x2643), (0x2660, 0x2661), (0x2663, 0x2664), (0x2665, 0x2667),
-    (0x266a, 0x266c)):
-        for i in range(_start, _stop):
-            allChrs[i] = chr(i)
-            allOrds[chr(i)] = i
+    (0x266a, 0x266c))
+
+
+def __getattr__(name):
+    """Builds the allChrs and allOrds tables of the WGL4 characters the first
+    time they are used, since most programs never use them."""
+    if name in ('allChrs', 'allOrds'):
+        allChrs = {}
+        allOrds = {}
+        for start, stop in _WGL4_RANGES:
+            for i in range(start, stop):
+                allChrs[i] = chr(i)
+                allOrds[chr(i)] = i
+        globals().update(allChrs=allChrs, allOrds=allOrds)
+        return globals()[name]
+    if name == 'windowsPrefixes':
+        return _windows_prefixes()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 # Figure out which modules to import:
@@ -658,6 +1841,10 @@ if currentPlatform == 'windows':
         _fields_ = [("size", ctypes.c_int), ("visible", ctypes.c_byte)]
 
     STD_OUTPUT_HANDLE = -11
+    STD_INPUT_HANDLE = -10
+    ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+    INFINITE = 0xFFFFFFFF
+    WAIT_OBJECT_0 = 0
 
     class COORD(ctypes.Structure):
         pass
@@ -665,52 +1852,235 @@ if currentPlatform == 'windows':
     COORD._fields_ = [("X", ctypes.c_short), ("Y", ctypes.c_short)]
 
     goto = _goto_win32_api
-    get_key = GetKeyWindows().get_key
+    _keyReader = GetKeyWindows()
 elif currentPlatform == 'unix':
     # macOS and Linux:
-    import tty, termios, select, codecs  # Used by get_key()
+    import tty, termios, select  # Used by get_key()
     goto = _goto_control_code
-    get_key = GetKeyUnix().get_key
+    _keyReader = GetKeyUnix()
 else:
     raise BextException('Unknown platform:' + sys.platform)
 
 
 
+# The Screen that last drew to the terminal with update(), which the
+# read_screen() functions read from.
+_lastScreen = None
+
+
+def _drawn_screen():
+    """Returns the Screen that last drew to the terminal."""
+    if _lastScreen is None:
+        raise BextException('the read_screen functions need a Screen that has been drawn with update()')
+    return _lastScreen
+
+
+def _drawn_text(screen, start, stop, step=1):
+    """Returns the characters that `screen` drew at its last update() from
+    flat index `start` up to `stop`, `step` apart, as a string."""
+    return screen._charsAtLastUpdate[start:stop:step].tobytes().decode(_CHARS_ENCODING, 'surrogatepass')
+
+
 def read_screen(x=None, y=None):
-    if x is None or y is None:
-        pass
-    pass
+    """Returns the character at `x`, `y` on the terminal, as drawn by the
+    last Screen to call update(), including its layers. Changes made to the
+    Screen since then aren't included until they're drawn. If only `x` or
+    only `y` is given, this returns that column or row as a string, and if
+    neither is, it returns the whole screen as a list of row strings.
+
+    This reads the Screen's copy of what it drew, never the terminal itself."""
+    screen = _drawn_screen()
+    if x is None and y is None:
+        return [_drawn_text(screen, row * screen.width, (row + 1) * screen.width) for row in range(screen.height)]
+    if x is None:
+        return read_screen_y(y)
+    if y is None:
+        return read_screen_x(x)
+    return _drawn_text(screen, screen._index(x, y), screen._index(x, y) + 1)
 
 def read_screen_x(x):
-    pass
+    """Returns column `x` of the terminal as a string. See read_screen()."""
+    screen = _drawn_screen()
+    if not 0 <= x < screen.width:
+        raise BextException('column %s is outside of the %s x %s screen' % (x, screen.width, screen.height))
+    return _drawn_text(screen, x, len(screen._chars), screen.width)
 
 def read_screen_y(y):
-    pass
+    """Returns row `y` of the terminal as a string. See read_screen()."""
+    screen = _drawn_screen()
+    if not 0 <= y < screen.height:
+        raise BextException('row %s is outside of the %s x %s screen' % (y, screen.width, screen.height))
+    return _drawn_text(screen, y * screen.width, (y + 1) * screen.width)
+
+
+def _import_numpy():
+    """Returns the numpy module, which is only needed by Screen.blit() and
+    Screen.to_array(), so bext doesn't require it to be installed."""
+    try:
+        import numpy
+    except ImportError:
+        raise BextException('This feature requires NumPy: pip install numpy')
+    return numpy
+
+
+# Screen stores characters as native-endian 32-bit code points:
+_CHARS_ENCODING = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+_COLOR_INDEXES = dict((color, i) for i, color in enumerate(ALL_COLORS))
+_COLOR_INDEXES['magenta'] = _COLOR_INDEXES['purple']
+
+
+def _color_name(index):
+    """Returns the name of the basic color with palette index `index`, or
+    `index` itself for the rest of the 256-color palette."""
+    return ALL_COLORS[index] if index < len(ALL_COLORS) else index
+
+
+def _color_index(color, default):
+    """Returns the 256-color palette index for `color`, which can be any of
+    the colors that fg() takes. RGB colors are replaced by the closest color
+    in the palette. The 'reset' color returns `default`."""
+    if isinstance(color, str):
+        name = color.lower()
+        if name == 'random':
+            import random
+            return random.randrange(len(ALL_COLORS))
+        if name == 'reset':
+            return default
+        if name in _COLOR_INDEXES:
+            return _COLOR_INDEXES[name]
+    elif _as_int(color) is not None:
+        index = _as_int(color)
+        if not 0 <= index <= 255:
+            raise BextException('Palette colors must be from 0 to 255, not ' + repr(color))
+        return index
+    return quantize(_parse_rgb(color))
+
+
+# The (columns, rows) of pixels in each cell for each Screen pixel_mode:
+_PIXEL_SIZES = {'halfblock': (1, 2), 'braille': (2, 4)}
+_UPPER_HALF_BLOCK = 0x2580
+# Braille characters are U+2800 plus a bit for each dot that is raised. These
+# are the bits for each dot, indexed by [row][column] within the cell:
+_BRAILLE_BLANK = 0x2800
+_BRAILLE_BITS = ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80))
+
+# Screen.update() searches for changed cells with NumPy (once blit() or
+# to_array() has been used) in damaged spans at least this long. Shorter
+# spans are faster to search with a plain loop.
+_MIN_NUMPY_RUN_SEARCH = 32
+
+# Screen.update() rewrites at most this many unchanged cells to move the
+# cursor past them; any farther, and a cursor movement code is always shorter.
+_MAX_REWRITTEN_GAP = 8
+
+
+def _shift_rows(buffer, width, top, bottom, n, blank):
+    """Moves the rows of `width` items in the flat `buffer` from row `top` down
+    to but not including row `bottom` up by `n` rows (down if `n` is
+    negative), filling the rows left behind with the one-item `blank`.
+
+    The slices assigned to always keep their length, because a buffer that
+    NumPy has a view of (see Screen.to_array()) can't be resized, not even
+    by assigning an empty slice to an empty slice."""
+    if abs(n) >= bottom - top:
+        buffer[top * width:bottom * width] = blank * ((bottom - top) * width)
+    elif n > 0:
+        buffer[top * width:(bottom - n) * width] = buffer[(top + n) * width:bottom * width]
+        buffer[(bottom - n) * width:bottom * width] = blank * (n * width)
+    else:
+        n = -n
+        buffer[(top + n) * width:bottom * width] = buffer[top * width:(bottom - n) * width]
+        buffer[top * width:(top + n) * width] = blank * (n * width)
 
 
 class Screen():
-    def __init__(self, width=None, height=None):
+    """An in-memory buffer of characters and colors that is drawn to the
+    terminal by update().
+
+    The cells are stored row by row in flat arrays: the characters as
+    32-bit code points in an array('I'), and the foreground and background
+    colors as indexes into the 256-color palette in two bytearrays (RGB
+    colors are replaced by the closest palette color). That's 6 bytes per
+    cell, plus another 6 bytes per cell for the copy of what was drawn at the
+    last update(), so a 400 x 120 screen takes about 576 KB.
+
+    Pixels drawn with pixel() take another byte per pixel in 'halfblock'
+    mode, or another byte per cell in 'braille' mode.
+
+    Every change to a cell marks the columns it touched in that row as
+    damaged, and update() only looks at the damaged part of each damaged row."""
+
+    __slots__ = ('width', 'height', '_chars', '_fgColors', '_bgColors',
+                 '_charsAtLastUpdate', '_fgAtLastUpdate', '_bgAtLastUpdate',
+                 '_dirtyRows', '_dirtyLeft', '_dirtyRight',
+                 '_cursorx', '_cursory', '_fg', '_bg', '_arrays', '_stream',
+                 '_sgrState', '_pixelMode', '_pixels', '_pixelCells', '_scrolls',
+                 '_layers', '_composite')
+
+    DEFAULT_FG = _COLOR_INDEXES['white']
+    DEFAULT_BG = _COLOR_INDEXES['black']
+
+    def __init__(self, width=None, height=None, stream=None, pixel_mode='halfblock'):
+        """Creates a screen of `width` columns and `height` rows, or the size
+        of the terminal if they aren't given. If `stream` is given, update()
+        writes to it instead of stdout. A headless screen with a
+        file-like `stream` such as io.StringIO() can be drawn to and updated
+        without a terminal, which is useful for tests.
+
+        The `pixel_mode` is how pixel() draws: 'halfblock' for 2 colored
+        pixels per cell, stacked vertically, or 'braille' for 2 x 4 dots per
+        cell in one color."""
+        if pixel_mode not in _PIXEL_SIZES:
+            raise BextException("pixel_mode must be 'halfblock' or 'braille', not " + repr(pixel_mode))
         if width is None or height is None:
-            width, height = shutil.get_terminal_size()
-
-        self._chars = []
-        self._fg = []
-        self._bg = []
-        self._charsAtLastUpdate = []
-        self._fgAtLastUpdate = []
-        self._bgAtLastUpdate = []
+            if stream is not None:
+                raise BextException('width and height are required when stream is given')
+            width, height = size()
+        self._stream = stream
+        # A headless screen tracks the colors set in its own stream.
+        self._sgrState = _sgrState if stream is None else [None, None]
+        self.width = width
+        self.height = height
+        area = width * height
+
         self._cursorx = 0
         self._cursory = 0
-        self._fg = 'white'
-        self._bg = 'black'
-
-        for y in range(width):
-            self._chars.append([' '] * height)
-            self._fg.append([' '] * height)
-            self._bg.append([' '] * height)
-            self._charsAtLastUpdate.append([' '] * height)
-            self._fgAtLastUpdate.append([' '] * height)
-            self._bgAtLastUpdate.append([' '] * height)
+        self._fg = self.DEFAULT_FG
+        self._bg = self.DEFAULT_BG
+
+        self._chars = array.array('I', [ord(' ')]) * area
+        self._fgColors = bytearray([self._fg]) * area
+        self._bgColors = bytearray([self._bg]) * area
+        # The terminal's contents are unknown until the first update(), so
+        # these start as NUL characters to make every cell count as changed.
+        self._charsAtLastUpdate = array.array('I', [0]) * area
+        self._fgAtLastUpdate = bytearray(area)
+        self._bgAtLastUpdate = bytearray(area)
+
+        # The pixels drawn by pixel(), created when it's first called, and the
+        # flat indexes of the cells whose glyphs update() has to recompute.
+        self._pixelMode = pixel_mode
+        self._pixels = None
+        self._pixelCells = set()
+
+        # The damaged columns of row y are _dirtyLeft[y] up to but not
+        # including _dirtyRight[y]. Every row starts out fully damaged.
+        self._dirtyRows = set(range(height))
+        self._dirtyLeft = array.array('i', [0]) * height
+        self._dirtyRight = array.array('i', [width]) * height
+
+        # NumPy views of the cell buffers, created by blit() and to_array().
+        self._arrays = None
+
+        # The (n, top, bottom) of each scroll() that the terminal has to do
+        # at the next update().
+        self._scrolls = []
+
+        # The layers drawn over the screen's own cells, bottom layer first,
+        # and the buffers of chars, fg, and bg colors they're composited
+        # into (None until the first layer is added).
+        self._layers = []
+        self._composite = None
 
 
     def goto(self, x=None, y=None):
@@ -720,29 +2090,29 @@ class Screen():
             self._cursory = y
 
 
-    def fg(self, color):
-        self._fg = color
-
-    def bg(self, color):
-        self._bg = color
-
     def print(self, *args, sep=' ', end='\n', fg=None, bg=None):
         text = sep.join(args) + end
-        if fg is None:
-            fg = self._fg
-        if bg is None:
-            bg = self._bg
+        fg = self._fg if fg is None else _color_index(fg, self.DEFAULT_FG)
+        bg = self._bg if bg is None else _color_index(bg, self.DEFAULT_BG)
 
+        startx = self._cursorx # Where the text written on the current row begins.
         for char in text:
             # TODO handle \b and \t and \r
             if char == '\n' or self._cursorx >= self.width:
-                self._cursorx = 0
+                self._damage(self._cursory, startx, self._cursorx)
+                self._cursorx = startx = 0
                 self._cursory += 1
-                if _cursory >= self.height:
-                    return # don't print anything past the end of the screen; bext doesn't scroll up.
-
-
-            self._chars[self._cursorx][self._cursory] = char
+            if self._cursory >= self.height:
+                return # don't print anything past the end of the screen; bext doesn't scroll up.
+            if char == '\n':
+                continue
+
+            i = self._cursory * self.width + self._cursorx
+            self._chars[i] = ord(char)
+            self._fgColors[i] = fg
+            self._bgColors[i] = bg
+            self._cursorx += 1
+        self._damage(self._cursory, startx, self._cursorx)
 
     def write(self, *args):
         self.print(*args, sep='', end='')
@@ -750,35 +2120,706 @@ class Screen():
     def clear(self):
         pass
 
-    def update(self):
-        pass
+    def update(self, sync=False):
+        """Draws the cells that have changed since the last call to update()
+        to the terminal. Adjacent changed cells of the same colors are joined
+        into runs so that only one cursor move is needed per run, and the
+        runs are drawn grouped by color so that each color's escape code is
+        written once. The whole frame is written to the screen's stream
+        (stdout, unless another was given) as a single string.
+
+        The `sync` parameter works the same as for batch(). When called in a
+        batch, the batch decides whether to use synchronized output."""
+        global _lastScreen
+        if self._stream is None:
+            _lastScreen = self
+        if self._pixelCells:
+            self._draw_pixel_cells()
+        if not self._dirtyRows:
+            return # Nothing has been drawn since the last update().
+
+        if self._composite is not None:
+            self._composite_damaged_cells()
+
+        output = []
+        if self._scrolls:
+            # Scroll the terminal the same way scroll() shifted the buffers:
+            # set the scroll region with DECSTBM, then index (IND) at its
+            # bottom row to scroll up, or reverse index (RI) at its top row
+            # to scroll down. Resetting the region moves the cursor home.
+            for n, top, bottom in self._scrolls:
+                output.append('\x1b[%d;%dr' % (top + 1, bottom))
+                if n > 0:
+                    output.append('\x1b[%d;1H' % bottom + '\x1bD' * n)
+                else:
+                    output.append('\x1b[%d;1H' % (top + 1) + '\x1bM' * -n)
+            output.append('\x1b[r')
+            del self._scrolls[:]
+
+        chars, fgColors, bgColors = self._shown_cells()
+        lastChars, lastFg, lastBg = self._charsAtLastUpdate, self._fgAtLastUpdate, self._bgAtLastUpdate
+
+        # Find the runs of changed cells, grouped by their (fg, bg) colors:
+        runsByColor = {}
+        for y in sorted(self._dirtyRows):
+            rowStart = y * self.width + self._dirtyLeft[y]
+            rowEnd = y * self.width + self._dirtyRight[y]
+            self._dirtyLeft[y] = self.width
+            self._dirtyRight[y] = 0
+            if (chars[rowStart:rowEnd] == lastChars[rowStart:rowEnd] and
+                    fgColors[rowStart:rowEnd] == lastFg[rowStart:rowEnd] and
+                    bgColors[rowStart:rowEnd] == lastBg[rowStart:rowEnd]):
+                continue # The damaged cells were set back to what was drawn. (These comparisons run in C.)
+
+            for runStart, runEnd in self._changed_runs(rowStart, rowEnd):
+                color = (fgColors[runStart], bgColors[runStart])
+                runsByColor.setdefault(color, []).append((runStart - y * self.width, y, runStart, runEnd))
+
+            lastChars[rowStart:rowEnd] = chars[rowStart:rowEnd]
+            lastFg[rowStart:rowEnd] = fgColors[rowStart:rowEnd]
+            lastBg[rowStart:rowEnd] = bgColors[rowStart:rowEnd]
+        self._dirtyRows.clear()
+
+        # Draw the runs in the colors that are already set first:
+        sgrState = self._sgrState
+        colorParams = dict((color, (_index_param(color[0]), _index_param(color[1], background=True)))
+                           for color in runsByColor)
+        colorOrder = sorted(runsByColor, key=lambda color: (colorParams[color][0] != sgrState[0]) +
+                                                           (colorParams[color][1] != sgrState[1]))
+        cursorx = cursory = None # The cursor position is unknown until the first move.
+        for color in colorOrder:
+            output.append(_sgr_code(colorParams[color][0], colorParams[color][1], sgrState))
+            for x, y, runStart, runEnd in runsByColor[color]:
+                # The unchanged cells between the cursor and the run can be
+                # rewritten instead of moving over them, if they're in the
+                # current colors:
+                gap = None
+                gapLength = x - cursorx if cursory == y and cursorx is not None else 0
+                if 0 < gapLength <= _MAX_REWRITTEN_GAP:
+                    gapStart = runStart - gapLength
+                    if (fgColors[gapStart:runStart].count(color[0]) == gapLength and
+                            bgColors[gapStart:runStart].count(color[1]) == gapLength):
+                        gap = chars[gapStart:runStart].tobytes().decode(_CHARS_ENCODING, 'surrogatepass')
+                output.append(_cursor_move_code(cursorx, cursory, x, y, gap))
+                output.append(chars[runStart:runEnd].tobytes().decode(_CHARS_ENCODING, 'surrogatepass'))
+
+                # After writing to the last column, terminals leave the cursor
+                # in a "pending wrap" state, so its position is unreliable.
+                cursorx = x + runEnd - runStart
+                cursory = y
+                if cursorx >= self.width:
+                    cursorx = cursory = None
+
+        stream = sys.stdout if self._stream is None else self._stream
+        if self._stream is None and _batchedStdout is not None:
+            sync = False # The batch wraps the whole frame instead.
+        elif self._stream is not None and sync is None:
+            sync = False # A headless screen never asks the terminal anything.
+        stream.write(_synchronized(''.join(output), sync))
+        stream.flush()
+
+    def loop(self, update_fn, fps=30, max_frame_skip=5, sync=False):
+        """Runs a game loop that calls `update_fn(dt)` and then this screen's
+        update() `fps` times a second, until `update_fn` returns False. See
+        run() for details."""
+        run(update_fn, fps, self.update, max_frame_skip, sync)
+
+    def _changed_runs(self, start, end):
+        """Returns a list of (runStart, runEnd) tuples of the runs of changed
+        cells of the same colors between the flat indexes `start` and `end`."""
+        if self._arrays is not None and self._composite is None and end - start >= _MIN_NUMPY_RUN_SEARCH:
+            return self._changed_runs_numpy(start, end)
+
+        chars, fgColors, bgColors = self._shown_cells()
+        lastChars, lastFg, lastBg = self._charsAtLastUpdate, self._fgAtLastUpdate, self._bgAtLastUpdate
+        runs = []
+        i = start
+        while i < end:
+            if chars[i] == lastChars[i] and fgColors[i] == lastFg[i] and bgColors[i] == lastBg[i]:
+                i += 1
+                continue
+
+            # Found the start of a run of changed cells:
+            runStart = i
+            fgColor, bgColor = fgColors[i], bgColors[i]
+            while (i < end and fgColors[i] == fgColor and bgColors[i] == bgColor and
+                   (chars[i] != lastChars[i] or fgColors[i] != lastFg[i] or bgColors[i] != lastBg[i])):
+                i += 1
+            runs.append((runStart, i))
+        return runs
+
+    def _changed_runs_numpy(self, start, end):
+        """The same as _changed_runs(), but finds the runs with vectorized
+        NumPy operations instead of looping over every cell."""
+        numpy = _import_numpy()
+        chars, fgColors, bgColors, lastChars, lastFg, lastBg = (a[start:end] for a in self._arrays)
+        changed = numpy.flatnonzero((chars != lastChars) | (fgColors != lastFg) | (bgColors != lastBg))
+        if changed.size == 0:
+            return []
+
+        # A new run starts wherever the changed cells aren't next to each
+        # other or the colors are different from the previous changed cell:
+        before, after = changed[:-1], changed[1:]
+        breaks = ((after != before + 1) | (fgColors[after] != fgColors[before]) |
+                  (bgColors[after] != bgColors[before]))
+        runStarts = numpy.concatenate((changed[:1], after[breaks])) + start
+        runEnds = numpy.concatenate((before[breaks], changed[-1:])) + start + 1
+        return list(zip(runStarts.tolist(), runEnds.tolist()))
+
+    def _numpy_arrays(self):
+        """Returns NumPy arrays that share memory with the flat cell buffers,
+        creating them the first time this is called."""
+        if self._arrays is None:
+            numpy = _import_numpy()
+            self._arrays = (numpy.frombuffer(self._chars, dtype=numpy.uint32),
+                            numpy.frombuffer(self._fgColors, dtype=numpy.uint8),
+                            numpy.frombuffer(self._bgColors, dtype=numpy.uint8),
+                            numpy.frombuffer(self._charsAtLastUpdate, dtype=numpy.uint32),
+                            numpy.frombuffer(self._fgAtLastUpdate, dtype=numpy.uint8),
+                            numpy.frombuffer(self._bgAtLastUpdate, dtype=numpy.uint8))
+        return self._arrays
+
+    def to_array(self, buffer='chars'):
+        """Returns a read-only NumPy array of shape (height, width) that shares
+        memory with the screen's cells. The `buffer` parameter is 'chars' for
+        the characters as uint32 code points, or 'fg' or 'bg' for the colors as
+        uint8 indexes into the 256-color palette. Requires NumPy."""
+        try:
+            flat = self._numpy_arrays()[('chars', 'fg', 'bg').index(buffer)]
+        except ValueError:
+            raise BextException("buffer must be 'chars', 'fg', or 'bg', not " + repr(buffer))
+        view = flat.reshape(self.height, self.width)
+        view.flags.writeable = False
+        return view
+
+    def blit(self, chars, fg=None, bg=None, x=0, y=0):
+        """Copies the 2D NumPy array `chars` onto the screen with its top-left
+        corner at `x`, `y`. The array can hold code points or single-character
+        strings. The `fg` and `bg` colors can be arrays of 256-color palette
+        indexes of the same shape (see quantize() to convert RGB colors), a
+        single index, or None for the screen's current colors. The parts that fall outside of the screen are cut off.
+
+        The changed cells are found by comparing the whole area against what
+        was drawn at the last update() with vectorized operations, so this is
+        much faster than setting each cell. Requires NumPy."""
+        numpy = _import_numpy()
+        chars = numpy.asarray(chars)
+        if chars.ndim != 2:
+            raise BextException('chars must be a 2D array, not %sD' % chars.ndim)
+        if chars.dtype.kind == 'U':
+            chars = chars.astype('U1').view(numpy.uint32)
+
+        # Cut off the parts of the array that are outside of the screen:
+        left, top = max(x, 0), max(y, 0)
+        right = min(x + chars.shape[1], self.width)
+        bottom = min(y + chars.shape[0], self.height)
+        if left >= right or top >= bottom:
+            return
+        source = (slice(top - y, bottom - y), slice(left - x, right - x))
+        target = (slice(top, bottom), slice(left, right))
+
+        screenArrays = [flat.reshape(self.height, self.width) for flat in self._numpy_arrays()]
+        screenChars, screenFg, screenBg, lastChars, lastFg, lastBg = (a[target] for a in screenArrays)
+        screenChars[...] = chars[source]
+        for color, screenColors, current in ((fg, screenFg, self._fg), (bg, screenBg, self._bg)):
+            if color is None:
+                screenColors[...] = current
+                continue
+            color = numpy.asarray(color)
+            if color.size and (color.min() < 0 or color.max() > 255):
+                raise BextException('color indexes must be from 0 to 255')
+            screenColors[...] = color[source] if color.ndim == 2 else color
+
+        changed = (screenChars != lastChars) | (screenFg != lastFg) | (screenBg != lastBg)
+        for row in numpy.flatnonzero(changed.any(axis=1)).tolist():
+            columns = numpy.flatnonzero(changed[row])
+            self._damage(top + row, left + int(columns[0]), left + int(columns[-1]) + 1)
 
-    def pixel(self, x, y, color):
-        pass
+    @property
+    def pixel_width(self):
+        """The width of the screen in pixels. See pixel()."""
+        return self.width * _PIXEL_SIZES[self._pixelMode][0]
+
+    @property
+    def pixel_height(self):
+        """The height of the screen in pixels. See pixel()."""
+        return self.height * _PIXEL_SIZES[self._pixelMode][1]
+
+    def pixel(self, x, y, color='white'):
+        """Sets the pixel at `x`, `y` to `color`, which can be any of the
+        colors that fg() takes. The screen has pixel_width x pixel_height
+        pixels, depending on its pixel_mode:
+
+        * 'halfblock': each cell is 2 pixels stacked vertically, drawn with
+          half-block characters. A `color` of None sets the pixel to the
+          screen's background color.
+        * 'braille': each cell is 2 x 4 dots, drawn with braille characters.
+          A `color` of None turns the dot off, and otherwise the dot is turned
+          on and the whole cell's foreground changes to `color`.
+
+        The characters are worked out at the next update(), so setting many
+        pixels in the same cell only costs a bit or byte change each.
+
+        (0, 0) is the top-left pixel."""
+        if not (0 <= x < self.pixel_width and 0 <= y < self.pixel_height):
+            raise BextException('(%s, %s) is outside of the %s x %s pixels' % (x, y, self.pixel_width, self.pixel_height))
+
+        cellx, celly = x // _PIXEL_SIZES[self._pixelMode][0], y // _PIXEL_SIZES[self._pixelMode][1]
+        cell = celly * self.width + cellx
+        if self._pixelMode == 'halfblock':
+            # One byte per pixel, holding its palette index:
+            if self._pixels is None:
+                self._pixels = bytearray([self.DEFAULT_BG]) * (self.width * self.height * 2)
+            self._pixels[y * self.width + x] = self._bg if color is None else _color_index(color, self.DEFAULT_FG)
+        else:
+            # One byte per cell, holding the 8 dots of its braille character as bits:
+            if self._pixels is None:
+                self._pixels = bytearray(self.width * self.height)
+            bit = _BRAILLE_BITS[y % 4][x % 2]
+            if color is None:
+                self._pixels[cell] &= ~bit
+            else:
+                self._pixels[cell] |= bit
+                self._fgColors[cell] = _color_index(color, self.DEFAULT_FG)
+        self._pixelCells.add(cell)
+        self._damage(celly, cellx, cellx + 1)
+
+    def _draw_pixel_cells(self):
+        """Sets the characters and colors of the cells that pixel() changed."""
+        pixels, chars = self._pixels, self._chars
+        if self._pixelMode == 'halfblock':
+            fgColors, bgColors, width = self._fgColors, self._bgColors, self.width
+            for cell in self._pixelCells:
+                top = pixels[cell + (cell // width) * width] # The pixel row is twice the cell row.
+                bottom = pixels[cell + (cell // width + 1) * width]
+                # A cell with two pixels of the same color is just a space:
+                chars[cell] = _UPPER_HALF_BLOCK if top != bottom else 32
+                fgColors[cell] = top
+                bgColors[cell] = bottom
+        else:
+            for cell in self._pixelCells:
+                chars[cell] = _BRAILLE_BLANK + pixels[cell]
+        self._pixelCells.clear()
+
+    def scroll(self, n=1, top=0, bottom=None):
+        """Scrolls the rows from row `top` down to but not including row
+        `bottom` (the bottom edge if it's None) up by `n` rows, or down if
+        `n` is negative. The rows that scroll out of the region are lost, and
+        the rows that scroll in are blank in the current colors.
+
+        The next update() scrolls the terminal the same way with a scroll
+        region (DECSTBM) instead of redrawing every cell that moved, so only
+        the blank rows and cells changed since have to be drawn. This is much
+        less output for log panes and chat views that scroll a line at a time.
+        (A screen narrower than the terminal redraws the region instead, since
+        scrolling would also move the columns to its right, and so does the
+        older Windows console, which can't scroll a region.)"""
+        bottom = self.height if bottom is None else bottom
+        if not 0 <= top < bottom <= self.height:
+            raise BextException('the scroll region must be rows 0 to %s, not %s to %s' % (self.height, top, bottom))
+        height = bottom - top
+        if n == 0:
+            return
+        if self._pixelCells:
+            self._draw_pixel_cells()
+
+        # Shift the cells and mark the blank rows that scrolled in as damaged:
+        if abs(n) > height:
+            n = height if n > 0 else -height
+        width = self.width
+        blankChar, blankFg, blankBg = array.array('I', [32]), bytearray([self._fg]), bytearray([self._bg])
+        _shift_rows(self._chars, width, top, bottom, n, blankChar)
+        _shift_rows(self._fgColors, width, top, bottom, n, blankFg)
+        _shift_rows(self._bgColors, width, top, bottom, n, blankBg)
+        if self._pixels is not None:
+            pixelRows = _PIXEL_SIZES[self._pixelMode][1] if self._pixelMode == 'halfblock' else 1
+            blankPixels = bytearray([self._bg if self._pixelMode == 'halfblock' else 0])
+            _shift_rows(self._pixels, width, top * pixelRows, bottom * pixelRows, n * pixelRows, blankPixels)
+        _shift_rows(self._dirtyLeft, 1, top, bottom, n, array.array('i', [0]))
+        _shift_rows(self._dirtyRight, 1, top, bottom, n, array.array('i', [width]))
+        for y in range(top, bottom):
+            if self._dirtyLeft[y] < self._dirtyRight[y]:
+                self._dirtyRows.add(y)
+            else:
+                self._dirtyRows.discard(y)
+        if self._composite is not None:
+            for buffer, blank in zip(self._composite, (blankChar, blankFg, blankBg)):
+                _shift_rows(buffer, width, top, bottom, n, blank)
+            # The layers stay where they are, so the cells under them and
+            # the cells their old picture scrolled to have to be redrawn:
+            for layer in self._layers:
+                if layer._visible:
+                    self._damage_rect(layer._x, layer._y, layer.width, layer.height, top, bottom)
+                    self._damage_rect(layer._x, layer._y - n, layer.width, layer.height, top, bottom)
+
+        if (abs(n) == height or
+                (self._stream is None and self.width != size()[0]) or
+                (currentPlatform == 'windows' and self._stream is None and _ansiWriter is None)):
+            # The terminal can't scroll just this screen's cells (or nothing on
+            # it can be reused), so update() redraws the region.
+            for y in range(top, bottom):
+                self._damage(y, 0, width)
+            return
+
+        # Shift what update() knows is on the terminal the same way the
+        # terminal will scroll, leaving the rows that scroll in unknown (NUL)
+        # so that they're drawn:
+        _shift_rows(self._charsAtLastUpdate, width, top, bottom, n, array.array('I', [0]))
+        _shift_rows(self._fgAtLastUpdate, width, top, bottom, n, bytearray(1))
+        _shift_rows(self._bgAtLastUpdate, width, top, bottom, n, bytearray(1))
+        if self._scrolls and self._scrolls[-1][1:] == (top, bottom):
+            n += self._scrolls.pop()[0] # Scroll the same region once, by the total.
+        if n:
+            self._scrolls.append((n, top, bottom))
+
+    def add_layer(self, width=None, height=None, x=0, y=0, z=0):
+        """Returns a new, fully transparent Layer of `width` x `height` cells
+        (the size of the screen if they aren't given) drawn over the screen
+        with its top-left corner at `x`, `y`. Layers with a higher `z` are
+        drawn over layers with a lower one, and layers with the same `z` are
+        drawn in the order they were added. The screen's own cells are below
+        all of the layers.
+
+        The read methods such as read() and find() read the screen's own
+        cells, not the layers."""
+        layer = Layer(self, self.width if width is None else width, self.height if height is None else height, x, y, z)
+        if self._composite is None:
+            self._composite = (array.array('I', self._chars), bytearray(self._fgColors), bytearray(self._bgColors))
+        self._layers.append(layer)
+        self._sort_layers()
+        return layer
+
+    def remove_layer(self, layer):
+        """Removes `layer` from the screen. The cells it covered are redrawn
+        at the next update()."""
+        if layer._screen is not self:
+            raise BextException('the layer is not on this screen')
+        layer._damage(0, 0, layer.width, layer.height)
+        self._layers.remove(layer)
+        layer._screen = None
+        if not self._layers:
+            self._composite = None
+
+    @property
+    def layers(self):
+        """A tuple of the screen's layers, bottom layer first."""
+        return tuple(self._layers)
+
+    def _sort_layers(self):
+        """Puts the layers in the order they're drawn in. The sort is stable,
+        so layers with the same z stay in the order they were added."""
+        self._layers.sort(key=lambda layer: layer._z)
+
+    def _shown_cells(self):
+        """Returns the chars, fg, and bg buffers of what update() draws: the
+        composited cells if there are layers, or the screen's own cells."""
+        if self._composite is not None:
+            return self._composite
+        return self._chars, self._fgColors, self._bgColors
+
+    def _composite_damaged_cells(self):
+        """Copies the screen's own damaged cells into the composited cells,
+        and then the visible layers' cells over them, bottom layer first.
+        Transparent layer cells (code point 0) are skipped, and runs of
+        opaque cells are copied with one slice assignment each."""
+        chars, fgColors, bgColors = self._composite
+        width = self.width
+        for y in self._dirtyRows:
+            left, right = self._dirtyLeft[y], self._dirtyRight[y]
+            rowStart = y * width
+            chars[rowStart + left:rowStart + right] = self._chars[rowStart + left:rowStart + right]
+            fgColors[rowStart + left:rowStart + right] = self._fgColors[rowStart + left:rowStart + right]
+            bgColors[rowStart + left:rowStart + right] = self._bgColors[rowStart + left:rowStart + right]
+            for layer in self._layers:
+                if not layer._visible or not layer._y <= y < layer._y + layer.height:
+                    continue
+                start, end = max(left, layer._x), min(right, layer._x + layer.width)
+                if start >= end:
+                    continue
+                offset = (y - layer._y) * layer.width - layer._x # Turns a screen column into a layer index.
+                layerChars = layer._chars[offset + start:offset + end]
+                transparent = layerChars.count(0)
+                if transparent == end - start:
+                    continue
+                if not transparent:
+                    chars[rowStart + start:rowStart + end] = layerChars
+                    fgColors[rowStart + start:rowStart + end] = layer._fgColors[offset + start:offset + end]
+                    bgColors[rowStart + start:rowStart + end] = layer._bgColors[offset + start:offset + end]
+                    continue
+                for x in range(start, end):
+                    if layer._chars[offset + x]:
+                        chars[rowStart + x] = layer._chars[offset + x]
+                        fgColors[rowStart + x] = layer._fgColors[offset + x]
+                        bgColors[rowStart + x] = layer._bgColors[offset + x]
+
+    def _damage_rect(self, x, y, width, height, top=0, bottom=None):
+        """Marks the cells of the `width` x `height` rectangle with its
+        top-left corner at `x`, `y` as damaged, cut off at the edges of the
+        screen and at rows `top` and `bottom`."""
+        bottom = self.height if bottom is None else bottom
+        left, right = max(x, 0), min(x + width, self.width)
+        for row in range(max(y, top), min(y + height, bottom)):
+            self._damage(row, left, right)
+
+    def _damage(self, y, left, right):
+        """Marks the cells in row `y` from column `left` up to but not
+        including column `right` as needing to be checked by update()."""
+        if left >= right:
+            return
+        self._dirtyRows.add(y)
+        if left < self._dirtyLeft[y]:
+            self._dirtyLeft[y] = left
+        if right > self._dirtyRight[y]:
+            self._dirtyRight[y] = right
+
+    def _index(self, x, y):
+        """Returns the index in the flat cell arrays of the cell at x, y."""
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise BextException('(%s, %s) is outside of the %s x %s screen' % (x, y, self.width, self.height))
+        return y * self.width + x
 
     def __getitem__(self, xy):
+        i = self._index(*xy)
+        if self._pixelCells:
+            self._draw_pixel_cells()
+        return chr(self._chars[i])
+
+    def read(self, x, y):
+        """Returns the (char, fg, bg) of the cell at `x`, `y`. The colors are
+        names for the 8 basic colors and 256-color palette indexes otherwise."""
+        i = self._index(x, y)
+        if self._pixelCells:
+            self._draw_pixel_cells()
+        return chr(self._chars[i]), _color_name(self._fgColors[i]), _color_name(self._bgColors[i])
+
+    def _read_cells(self, start, stop, step, buffer):
+        """Returns the cells from flat index `start` up to `stop`, `step`
+        apart, from the buffer named `buffer`. See read_row()."""
+        if self._pixelCells:
+            self._draw_pixel_cells()
+        if buffer == 'text':
+            return self._chars[start:stop:step].tobytes().decode(_CHARS_ENCODING, 'surrogatepass')
+        if buffer == 'chars':
+            return self._chars[start:stop:step]
+        if buffer == 'fg':
+            return self._fgColors[start:stop:step]
+        if buffer == 'bg':
+            return self._bgColors[start:stop:step]
+        raise BextException("buffer must be 'text', 'chars', 'fg', or 'bg', not " + repr(buffer))
+
+    def read_row(self, y, left=0, right=None, buffer='text'):
+        """Returns row `y` from column `left` up to but not including column
+        `right` (the right edge if it's None). With the default `buffer` of
+        'text' this is a string. Otherwise it's a copy of part of a cell
+        buffer: 'chars' for an array('I') of code points, or 'fg' or 'bg' for
+        a bytearray of 256-color palette indexes."""
+        if not 0 <= y < self.height:
+            raise BextException('row %s is outside of the %s x %s screen' % (y, self.width, self.height))
+        left, right, _ = slice(left, right).indices(self.width)
+        return self._read_cells(y * self.width + left, y * self.width + max(left, right), 1, buffer)
+
+    def read_column(self, x, top=0, bottom=None, buffer='text'):
+        """Returns column `x` from row `top` down to but not including row
+        `bottom` (the bottom edge if it's None). See read_row() for `buffer`."""
+        if not 0 <= x < self.width:
+            raise BextException('column %s is outside of the %s x %s screen' % (x, self.width, self.height))
+        top, bottom, _ = slice(top, bottom).indices(self.height)
+        return self._read_cells(top * self.width + x, max(top, bottom) * self.width, self.width, buffer)
+
+    def read_rect(self, x, y, width, height, buffer='text'):
+        """Returns a list of the `height` rows of the `width` x `height`
+        rectangle with its top-left corner at `x`, `y`, cut off at the edges
+        of the screen. See read_row() for `buffer`."""
+        left = max(x, 0)
+        right = max(x + width, left)
+        return [self.read_row(row, left, right, buffer) for row in range(max(y, 0), min(y + height, self.height))]
+
+    def find(self, text):
+        """Returns a list of the (x, y) coordinates of the first character of
+        every place `text` appears on the screen, top row first. Matches don't
+        wrap from the end of one row to the start of the next."""
+        if not text:
+            raise BextException('text must not be empty')
+        cells = self._read_cells(0, len(self._chars), 1, 'text')
+        found = []
+        i = cells.find(text)
+        while i != -1:
+            y, x = divmod(i, self.width)
+            if x + len(text) <= self.width:
+                found.append((x, y))
+                i = cells.find(text, i + 1)
+            else:
+                i = cells.find(text, (y + 1) * self.width) # Skip to the next row.
+        return found
+
+    def __setitem__(self, xy, char):
         x, y = xy
-        return self._chars[x][y]
+        i = self._index(x, y)
+        self._chars[i] = ord(char)
+        self._fgColors[i] = self._fg
+        self._bgColors[i] = self._bg
+        self._damage(y, x, x + 1)
+
+    @property
+    def fg(self):
+        return _color_name(self._fg)
+
+    @fg.setter
+    def fg(self, color):
+        self._fg = _color_index(color, self.DEFAULT_FG)
+
+    @property
+    def bg(self):
+        return _color_name(self._bg)
+
+    @bg.setter
+    def bg(self, color):
+        self._bg = _color_index(color, self.DEFAULT_BG)
+
+
+class Layer(object):
+    """A rectangle of cells drawn over a Screen, created by
+    Screen.add_layer(). Each cell has a character and colors like the
+    screen's cells, or is transparent (the character None) so that the
+    layers and screen below it show through. A new layer is all transparent.
+
+    Changing a layer's cells, position, z, or visible only marks the screen
+    cells it covers as damaged, and update() only recomposites the damaged
+    cells. So moving a sprite over a background costs work for the sprite's
+    cells, not the whole screen's."""
+
+    __slots__ = ('width', 'height', '_screen', '_x', '_y', '_z', '_visible',
+                 '_chars', '_fgColors', '_bgColors', '_fg', '_bg')
+
+    def __init__(self, screen, width, height, x=0, y=0, z=0):
+        if width < 1 or height < 1:
+            raise BextException('a layer must be at least 1 x 1, not %s x %s' % (width, height))
+        self._screen = screen
+        self.width = width
+        self.height = height
+        self._x = x
+        self._y = y
+        self._z = z
+        self._visible = True
+        self._fg = Screen.DEFAULT_FG
+        self._bg = Screen.DEFAULT_BG
+        area = width * height
+        self._chars = array.array('I', [0]) * area # Code point 0 is a transparent cell.
+        self._fgColors = bytearray([self._fg]) * area
+        self._bgColors = bytearray([self._bg]) * area
+
+    def _damage(self, x, y, width, height):
+        """Marks the screen cells under this layer's `width` x `height` cells
+        at `x`, `y` as damaged, if the layer is on a screen and visible."""
+        if self._visible and self._screen is not None:
+            self._screen._damage_rect(self._x + x, self._y + y, width, height)
+
+    def _index(self, x, y):
+        """Returns the index in the flat cell arrays of the cell at x, y."""
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise BextException('(%s, %s) is outside of the %s x %s layer' % (x, y, self.width, self.height))
+        return y * self.width + x
+
+    def __getitem__(self, xy):
+        code = self._chars[self._index(*xy)]
+        return chr(code) if code else None
 
     def __setitem__(self, xy, char):
         x, y = xy
-        self._chars[x][y] = char
+        i = self._index(x, y)
+        self._chars[i] = 0 if char is None else ord(char)
+        self._fgColors[i] = self._fg
+        self._bgColors[i] = self._bg
+        self._damage(x, y, 1, 1)
+
+    def draw(self, text, x=0, y=0, fg=None, bg=None, transparent=None):
+        """Writes `text` into the layer with its first character at `x`, `y`.
+        Each line of a multiline string starts at column `x` on the next row,
+        and the text is cut off at the edges of the layer. The cells where
+        `text` has the `transparent` character are left as they were, which
+        is handy for drawing sprites from strings."""
+        fg = self._fg if fg is None else _color_index(fg, Screen.DEFAULT_FG)
+        bg = self._bg if bg is None else _color_index(bg, Screen.DEFAULT_BG)
+        for row, line in enumerate(text.split('\n'), y):
+            if not 0 <= row < self.height:
+                continue
+            for column, char in enumerate(line, x):
+                if char == transparent or not 0 <= column < self.width:
+                    continue
+                i = row * self.width + column
+                self._chars[i] = ord(char)
+                self._fgColors[i] = fg
+                self._bgColors[i] = bg
+            self._damage(x, row, len(line), 1)
+
+    def fill(self, char=None):
+        """Sets every cell of the layer to `char` in the layer's colors, or
+        makes every cell transparent if `char` is None."""
+        area = self.width * self.height
+        self._chars[:] = array.array('I', [0 if char is None else ord(char)]) * area
+        self._fgColors[:] = bytearray([self._fg]) * area
+        self._bgColors[:] = bytearray([self._bg]) * area
+        self._damage(0, 0, self.width, self.height)
+
+    def move(self, x, y):
+        """Moves the layer's top-left corner to `x`, `y` on the screen."""
+        self._damage(0, 0, self.width, self.height)
+        self._x, self._y = x, y
+        self._damage(0, 0, self.width, self.height)
+
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, x):
+        self.move(x, self._y)
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, y):
+        self.move(self._x, y)
+
+    @property
+    def z(self):
+        return self._z
+
+    @z.setter
+    def z(self, z):
+        self._z = z
+        if self._screen is not None:
+            self._screen._sort_layers()
+        self._damage(0, 0, self.width, self.height)
+
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, visible):
+        if visible != self._visible:
+            self._visible = True
+            self._damage(0, 0, self.width, self.height) # Damage while visible, so hiding also redraws.
+            self._visible = bool(visible)
 
     @property
     def fg(self):
-        return self._fg
+        return _color_name(self._fg)
 
     @fg.setter
     def fg(self, color):
-        self._fg = color
+        self._fg = _color_index(color, Screen.DEFAULT_FG)
 
     @property
     def bg(self):
-        return self._bg
+        return _color_name(self._bg)
 
     @bg.setter
     def bg(self, color):
-        self._bg = color
+        self._bg = _color_index(color, Screen.DEFAULT_BG)
 
 
 
@@ -786,4 +2827,4 @@ class Screen():
 
 
 
-init() # Automatically called on import. Initializes Colorama.
+init() # Automatically called on import. Sets up stdout for colors.